@@ -2,8 +2,25 @@ import requests
 import json
 import gradio as gr
 import os
+import sys
+import threading
+import time
 import warnings
 from dotenv import load_dotenv
+from tts_cache import SynthesisCache, make_cache_key
+from audio_formats import PlayableChunks, accept_header, first_playable_offset, parse_output_format, pcm_array, segment_payload
+from long_form import split_text, synthesize_in_order
+from voice_catalog import Catalog, LABEL_FIELDS
+from catalog_refresh import CatalogRefresher
+from voice_settings_store import VoiceSettingsStore
+from elevenlabs_client import ElevenLabsClient, API_BASE_URL, read_body
+from resilience import AdaptiveConcurrencyLimiter, RetryPolicy
+from shared_store import SharedStore
+from single_flight import SingleFlight
+from fair_scheduler import BudgetExceeded, FairScheduler
+import prewarm
+from stream_input import DEFAULT_CHUNK_LENGTH_SCHEDULE, iterate_fragments, synthesize_stream_input
+from tts_metrics import metrics, profile_request, record_synthesis, stage_timer, start_metrics_server
 load_dotenv()
 # call https://api.elevenlabs.io/v1/voices to list the voice IDs with Xi-Api-Key in the header with value 4d02f07f1aa0ff0b5c12e208a9f69571
 
@@ -11,21 +28,68 @@ load_dotenv()
 api_key = os.getenv("11labs_api_key")
 cert_path = os.getenv("cert_path")
 
-# Check if api_key is present
+# Check if api_key is present, it can still be set from the UI
 if not api_key:
-    raise ValueError("API key not found in the .env file")
+    warnings.warn("API key not found in the .env file")
+    api_key = ""
 
 # Check if cert_path is present
 if not cert_path:
     warnings.warn("Certificate path not found in the .env file")
     cert_path = False
+
+# every API call goes through this client so that connections are pooled and the cert setting is applied once
+client = ElevenLabsClient(
+    api_key=api_key,
+    base_url=os.getenv("elevenlabs_base_url", API_BASE_URL),
+    verify=cert_path,
+    pool_size=int(os.getenv("http_pool_size", 16)),
+    connect_timeout=float(os.getenv("http_connect_timeout", 5)),
+    read_timeout=float(os.getenv("http_read_timeout", 60)),
+    retry_policy=RetryPolicy(
+        max_retries=int(os.getenv("http_max_retries", 4)),
+        base_delay=float(os.getenv("http_retry_base_delay", 0.5)),
+        ),
+    limiter=AdaptiveConcurrencyLimiter(
+        initial_limit=int(os.getenv("http_initial_concurrency", 8)),
+        max_limit=int(os.getenv("http_max_concurrency", 64)),
+        ),
+    )
     
 CHUNK_SIZE = 1024
-voice_settings_dir = "11labs/voice_settings"
+STREAM_CHUNK_SIZE = int(os.getenv("stream_chunk_size", 16 * 1024))
+STREAM_INPUT_SCHEDULE = [int(n) for n in os.getenv("stream_input_chunk_schedule", ",".join(map(str, DEFAULT_CHUNK_LENGTH_SCHEDULE))).split(",")]
+STREAM_INPUT_FLUSH = os.getenv("stream_input_flush", "false").lower() in ("1", "true", "yes")
+LONG_FORM_MAX_WORKERS = int(os.getenv("long_form_max_workers", 4))
+DEFAULT_MAX_CHARACTERS = 2500
+voice_settings_dir = "11labs/voice_settings" # legacy one file per voice, migrated into voice_settings_path
+voice_settings_path = "11labs/voice_settings_store.json"
+tts_cache_dir = "11labs/tts_cache"
+voices_path = "11labs/voices.json"
+models_path = "11labs/models.json"
+catalog_snapshot_path = "11labs/catalog.snapshot" # precompiled catalog, rewritten whenever the JSON files change
 
 models = []
 voices = []
-voice_settings_dict = {}
+catalog = Catalog()
+catalog_loaded = False
+catalog_lock = threading.Lock()
+# several workers / replicas on one host share their audio, voice settings and catalog refreshes through it
+shared_store = SharedStore(os.getenv("shared_store_dir")) if os.getenv("shared_store_dir") else None
+tts_cache = SynthesisCache(tts_cache_dir, store=shared_store, namespace="elevenlabs")
+in_flight = SingleFlight() # collapses identical synthesis requests that arrive while one is already running
+# every upstream synthesis waits its turn here : interactive before batch, fair share of the characters across users
+scheduler = FairScheduler(
+    max_concurrent=int(os.getenv("scheduler_max_concurrent", 8)),
+    default_budget=float(os.getenv("user_budget", 0)), # cost units (characters x token_cost_factor) per window, 0 = unlimited
+    budget_window=float(os.getenv("user_budget_window", 3600)),
+    budgets=json.loads(os.getenv("user_budgets", "{}")), # per user / API key overrides, e.g. {"10.0.0.5": 20000}
+    )
+# retries / throttling and cache stats are read at scrape time
+metrics.add_collector("elevenlabs_http", client.resilience_metrics)
+metrics.add_collector("elevenlabs_tts_cache", tts_cache.stats)
+metrics.add_collector("elevenlabs_single_flight", in_flight.stats)
+metrics.add_collector("elevenlabs_scheduler", scheduler.stats)
 output_formats = [
                 ("mp3_22050_32", "mp3_22050_32 - output format, mp3 with 22.05kHz sample rate at 32kbps"),
                 ("mp3_44100_32", "mp3_44100_32 - output format, mp3 with 44.1kHz sample rate at 32kbps"),
@@ -39,47 +103,59 @@ output_formats = [
                 ("pcm_44100", "pcm_44100 - PCM format (S16LE) with 44.1kHz sample rate. Requires you to be subscribed to Pro tier or above."),
                 ("ulaw_8000", "ulaw_8000 - μ-law format (sometimes written mu-law, often approximated as u-law) with 8kHz sample rate. Note that this format is commonly used for Twilio")
             ]
-try :
-    with open("11labs/voices.json", "r") as file:
-        voices = json.load(file)
-    voices = voices["voices"] 
-except Exception as e:
-    print(f"Warning : voices aren't loaded")
-    
 
-
-def load_models():
-    global models
+def read_models():
     try :
-        with open("11labs/models.json", "r") as file:
-            models = json.load(file)
+        with open(models_path, "r") as file:
+            return json.load(file)
     except Exception as e:
-        print(f"Warning : models aren't loaded")    
+        print(f"Warning : models aren't loaded")
+        return None
 
-load_models()
-def load_voices():
-    global voices
+def read_voices():
     try :
-        with open("11labs/voices.json", "r") as file:
-            voices = json.load(file)
-            voices = voices["voices"]
+        with open(voices_path, "r") as file:
+            return json.load(file)["voices"]
     except Exception as e:
         print(f"Warning : voices aren't loaded")
-load_voices()
-
-# load the voice settings
-for filename in os.listdir(voice_settings_dir):
-    file_path = os.path.join(voice_settings_dir, filename)
-    with open(file_path, "r") as file:
-        voice_content = file.read()
-        voice_settings_dict[filename]= voice_content
+        return None
+
+def save_catalog_snapshot():
+    try:
+        catalog.save_snapshot(catalog_snapshot_path, [voices_path, models_path])
+    except OSError as e:
+        print(f"Warning : catalog snapshot couldn't be written : {e}")
+
+def load_catalog():
+    # loaded on first use (or by the warm-up thread) : the snapshot when it is as recent as the JSON files,
+    # otherwise the JSON files are parsed once and a new snapshot is written for the next start
+    global voices, models, catalog_loaded
+    if catalog_loaded:
+        return catalog
+    with catalog_lock:
+        if not catalog_loaded:
+            if catalog.load_snapshot(catalog_snapshot_path, [voices_path, models_path]):
+                voices, models = catalog.voices, catalog.models
+            else:
+                voices = read_voices() or []
+                models = read_models() or []
+                catalog.rebuild(voices=voices, models=models)
+                save_catalog_snapshot()
+            catalog_loaded = True
+    return catalog
+
+# the voice settings, parsed and keyed by voice_id; the store reads its files on first use
+voice_settings_store = VoiceSettingsStore(
+    client,
+    voice_settings_path,
+    legacy_dir=voice_settings_dir,
+    max_workers=int(os.getenv("voice_settings_prefetch_workers", 8)),
+    shared_store=shared_store,
+    )
+voice_settings_dict = voice_settings_store.settings
         
 def get_voice_ids():
-    headers = {
-        "Xi-Api-Key": api_key
-    }
-
-    response = requests.get("https://api.elevenlabs.io/v1/voices", headers=headers, verify=cert_path)
+    response = client.get("voices")
 
     if response.status_code == 200:
         voice_ids = response.json()
@@ -88,115 +164,70 @@ def get_voice_ids():
     else:
         print(f"Error: {response.text}")
 
-def save_voices():
-    voice_ids = get_voice_ids()
-    with open("11labs/voices.json", "w") as file:
-        json.dump(voice_ids, file)
-    load_voices() # will load them to the global variable
-    return voice_ids
+def set_voices(voice_ids):
+    # copy-on-write : the new catalog is built aside, then swapped in
+    global voices
+    new_voices = voice_ids["voices"]
+    load_catalog()
+    catalog.rebuild(voices=new_voices)
+    voices = new_voices
+    save_catalog_snapshot()
 
-def save_models():
-    headers = {
-        "Xi-Api-Key": api_key
-    }
+def set_models(new_models):
+    global models
+    load_catalog()
+    catalog.rebuild(models=new_models)
+    models = new_models
+    save_catalog_snapshot()
 
-    response = requests.get("https://api.elevenlabs.io/v1/models", headers=headers, verify=cert_path)
+catalog_refresher = CatalogRefresher(
+    client,
+    interval=float(os.getenv("catalog_refresh_interval", 3600)),
+    jitter=0.2,
+    shared_store=shared_store,
+    )
+catalog_refresher.add_target("voices", "voices", voices_path, set_voices)
+catalog_refresher.add_target("models", "models", models_path, set_models)
 
-    if response.status_code == 200:
-        models = response.json()
-        with open("11labs/models.json", "w") as file:
-            json.dump(models, file)
-        load_models() # will load them to the global variable
-        # Process the models as needed
-        return models
-    else:
-        print(f"Error: {response.text}")
+def save_voices():
+    catalog_refresher.refresh("voices") # conditional fetch, atomic write, catalog swap
+    return {"voices": voices}
+
+def save_models():
+    catalog_refresher.refresh("models")
+    return models
 
 def model_exists(model_id, returnit = True):
-    global models
-    for model in models:
-        if model["model_id"] == model_id:
-            if returnit:
-                return model
-            return True
-    return False
+    model = load_catalog().get_model(model_id)
+    if model is None:
+        return False
+    return model if returnit else True
 
 def voice_exists(voice_id, returnit = True) -> dict | bool:
-    global voices
-    for voice in voices:
-        if voice["voice_id"] == voice_id:
-            if returnit:
-                return voice
-            return True
-    return False
+    voice = load_catalog().get_voice(voice_id)
+    if voice is None:
+        return False
+    return voice if returnit else True
 
 def load_voice_settings(voice_id, use_cache=True):
-    global voice_settings_dict
-    # Check if voice settings are cached and use_cache is True
-    voice_settings_cache_path = os.path.join(voice_settings_dir, f"{voice_id}.json")
-    if use_cache: # the voice settings are all loaded when the platform starts
-        if voice_id in voice_settings_dict.keys(): return voice_settings_dict[voice_id] # load from the ram first
-        if os.path.exists(voice_settings_cache_path):
-            with open(voice_settings_cache_path, "r") as file:
-                return json.load(file)
-    
-    # Fetch voice settings from the API if not found in cache or use_cache is False
-    url = f"https://api.elevenlabs.io/v1/voices/{voice_id}/settings"
-    headers = {"xi-api-key": api_key}
-    response = requests.get(url, headers=headers, verify=False)
+    # memory lookup when cached, otherwise fetched from the API and persisted in the store
+    return voice_settings_store.get(voice_id, use_cache=use_cache)
 
-    if response.status_code == 200:
-        voice_settings = response.json()
-        
-        # Save voice settings to cache
-        
-        os.makedirs(voice_settings_dir, exist_ok=True)
-        with open(voice_settings_cache_path, "w") as file:
-            json.dump(voice_settings, file)
-        voice_settings_dict[voice_id] = voice_settings
-        return voice_settings
-    else:
-        print(f"Failed to fetch voice settings for voice ID {voice_id}. Error: {response.text}")
-        return None
-    
+def prefetch_voice_settings(refresh=False, background=True):
+    voice_ids = [voice_id for _, voice_id in load_catalog().voice_choices()]
+    if background:
+        return voice_settings_store.prefetch_in_background(voice_ids, refresh=refresh)
+    return voice_settings_store.prefetch(voice_ids, refresh=refresh)
+
+def voice_settings_status():
+    stats = voice_settings_store.stats()
+    return f"{stats['voices']} voices cached, hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hit_rate']:.0%}"
 
-class VoiceLabels:
-    def __init__(self, voice_labels : dict) -> None:
-        if not isinstance(voice_labels, dict):
-            raise ValueError("voice_labels must be a dictionary")
-        self.accent = voice_labels.get("accent", None)
-        self.description = voice_labels.get("description", None)
-        self.age = voice_labels.get("age", None)
-        self.gender = voice_labels.get("gender", None)
-        self.use_case = voice_labels.get("use case", None)
-
-
-class Voice:
-    def __init__(self, voice_id):
-        self.voice : dict = voice_exists(voice_id, returnit=True)
-        self.voice_id = voice_id
-        self.id = voice_id
-        if self.voice :
-            self.name = self.voice.get("name", None)
-            self.preview_url = self.voice.get("preview_url", None)
-            
-            self.labels = VoiceLabels(self.voice.get("labels", None))
-            self.accent = self.labels.accent
-            self.description = self.labels.description
-            self.age = self.labels.age
-            self.gender = self.labels.gender
-            self.use_case = self.labels.use_case
-            
-            self.fine_tuning : dict | None = self.voice.get("fine_tuning", None)
-            self.fine_tuning_state =self.fine_tuning.get("fine_tuning_state", None) if self.fine_tuning else None
-            self.fine_tuning_language =self.fine_tuning.get("fine_tuning_state", None) if self.fine_tuning else None
-            self.high_quality_base_model_ids : list = self.voice.get("high_quality_base_model_ids", [])
-        else :
-            raise ValueError(f"Voice with ID {voice_id} doesn't exist")
-        
 def get_voice_info_and_preview(voice_id):
     try:
-        voice = Voice(voice_id=voice_id)
+        voice = load_catalog().get_voice_record(voice_id)
+        if voice is None:
+            raise ValueError(f"Voice with ID {voice_id} doesn't exist")
         info_text = f"Name: {voice.name}\n"
         info_text += f"Preview URL: {voice.preview_url}\n"
         info_text += f"Accent: {voice.accent}\n"
@@ -214,7 +245,7 @@ def get_voice_info_and_preview(voice_id):
             
 def test():
     
-    url = "https://api.elevenlabs.io/v1/text-to-speech/onwK4e9ZLuTAKqWW03F9"
+    url = "text-to-speech/onwK4e9ZLuTAKqWW03F9"
 
     querystring = {
         "optimize_streaming_latency":"1",
@@ -233,12 +264,11 @@ def test():
     }
     headers = {
         "Accept": "audio/mpeg",
-        "xi-api-key": api_key,
         "Content-Type": "application/json"
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers, params=querystring, verify=False)
+        response = client.post(url, json=payload, headers=headers, params=querystring)
         response.raise_for_status()  # This will raise an exception for HTTP error codes
 
         # Assuming response is fine, save the file
@@ -259,15 +289,21 @@ def test():
     except Exception as e:
         print(f"An error occurred: {e}")
     
-def text_to_speech(
+def synthesize_audio(
     text,
     model_id,
     voice_id,
     voice_settings,
     optimize_streaming_latency,
-    output_format
-    ):
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    output_format,
+    use_cache=True,
+    user="anonymous",
+    priority="interactive",
+    coalesce=True
+    ) -> tuple[bytes, bool]:
+    # returns (audio bytes, came from cache), raises requests exceptions on API errors.
+    # coalesce=False always makes its own upstream call (load tests, forced re-renders)
+    url = f"text-to-speech/{voice_id}"
 
     querystring = {
         "optimize_streaming_latency":optimize_streaming_latency,
@@ -279,56 +315,369 @@ def text_to_speech(
         "voice_settings": voice_settings
     }
     headers = {
-        "Accept": "audio/mpeg",
-        "xi-api-key": api_key,
+        "Accept": accept_header(output_format),
         "Content-Type": "application/json"
     }
+    cache_key = make_cache_key(
+        text=text,
+        model_id=model_id,
+        voice_id=voice_id,
+        voice_settings=voice_settings,
+        output_format=output_format
+        )
+    if use_cache: # with the cache off we still refresh the entry with the new audio
+        with stage_timer("elevenlabs", "cache_lookup"):
+            audio_data = tts_cache.get(cache_key)
+        if audio_data is not None:
+            record_synthesis("elevenlabs", len(text), len(audio_data), cache_hit=True)
+            return audio_data, True
+    cost = estimate_cost(text, model_id)
+    fetch = (fetch_audio, url, payload, headers, querystring, output_format, cache_key)
+    if coalesce:
+        # identical requests already in flight (several users, a retrying client) wait for that one's audio.
+        # Only within a priority class : an interactive request never waits on a queued batch / pre-warm job
+        audio_data = in_flight.do(("tts", cache_key, optimize_streaming_latency, priority), scheduler.run, user, cost, priority, *fetch)
+    else:
+        audio_data = scheduler.run(user, cost, priority, *fetch)
+    record_synthesis("elevenlabs", len(text), len(audio_data), cache_hit=False if use_cache else None)
+    return audio_data, False
+
+def estimate_cost(text, model_id):
+    # what the request is billed : characters x the model's token_cost_factor
+    model = model_exists(model_id) or {}
+    return len(text) * (model.get("token_cost_factor") or 1.0)
+
+def fetch_audio(url, payload, headers, querystring, output_format, cache_key):
+    # the upstream call behind synthesize_audio, its audio is written to the cache
+    # streamed so that the headers (connection setup + server TTFB, retries included) and the body download are timed apart
+    with stage_timer("elevenlabs", "ttfb"):
+        response = client.post(url, json=payload, headers=headers, params=querystring, stream=True)
+    try:
+        response.raise_for_status()  # This will raise an exception for HTTP error codes
+    except requests.exceptions.HTTPError:
+        print(f"Response status code: {response.status_code}")
+        print(f"Response text: {response.text}")
+        raise
+    with stage_timer("elevenlabs", "download"):
+        if parse_output_format(output_format)[0] == "pcm":
+            audio_data = read_body(response) # one preallocated buffer, no join of the chunks, that pcm_array() views as is
+        else:
+            audio_data = response.content
+    with stage_timer("elevenlabs", "cache_write"):
+        tts_cache.put(cache_key, audio_data) # the cache keeps its own bytes copy of a pcm buffer
+    return audio_data
+
+def text_to_speech(
+    text,
+    model_id,
+    voice_id,
+    voice_settings,
+    optimize_streaming_latency,
+    output_format,
+    use_cache=True,
+    user="anonymous",
+    priority="interactive",
+    coalesce=True
+    ):
     if not model_id or not voice_id:
         print("Model ID or Voice ID not selected.")
         return None, "Model ID or Voice ID not selected."
     try:
-        response = requests.post(url, json=payload, headers=headers, params=querystring, verify=False)
-        response.raise_for_status()  # This will raise an exception for HTTP error codes
-        save_path = f'output.mp3'
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-        print("File has been written successfully.")
-        return save_path, "TTS Successfull."
+        with profile_request("elevenlabs_tts"), stage_timer("elevenlabs", "total"):
+            audio_data, from_cache = synthesize_audio(
+                text=text,
+                model_id=model_id,
+                voice_id=voice_id,
+                voice_settings=voice_settings,
+                optimize_streaming_latency=optimize_streaming_latency,
+                output_format=output_format,
+                use_cache=use_cache,
+                user=user,
+                priority=priority,
+                coalesce=coalesce
+                )
+        # the audio goes straight to Gradio as bytes : no shared output file that concurrent requests could overwrite;
+        # raw pcm goes as (rate, int16 samples) over the same buffer, nothing to decode
+        if parse_output_format(output_format)[0] == "pcm":
+            audio_data = pcm_array(audio_data, output_format)
+        if from_cache:
+            print("Loaded TTS from cache.")
+            return audio_data, f"TTS Successfull (cache hit, {tts_cache_status()})."
+        return audio_data, "TTS Successfull."
+
+    except BudgetExceeded as e:
+        print(e)
+        return None, str(e)
 
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP error occurred: {http_err}")  # Python 3.6
-        print(f"Response status code: {response.status_code}")
-        print(f"Response text: {response.text}")
-        return None, f"HTTP error occurred: {http_err}"
+        metrics.inc("tts_errors_total", provider="elevenlabs")
+        return None, f"HTTP error occurred: {http_err} ({resilience_status()})"
 
     except requests.exceptions.RequestException as err:
         print(f"Error occurred: {err}")
+        metrics.inc("tts_errors_total", provider="elevenlabs")
         return None, f"Error occurred: {err}"
 
     except Exception as e:
         print(f"An error occurred: {e}")
+        metrics.inc("tts_errors_total", provider="elevenlabs")
         return None, f"An error occurred: {e}"
+
+def model_max_characters(model_id):
+    model = model_exists(model_id)
+    if not model:
+        return DEFAULT_MAX_CHARACTERS
+    return model.get("max_characters_request_subscribed_user") or model.get("max_characters_request_free_user") or DEFAULT_MAX_CHARACTERS
+
+def iter_long_form_audio(
+    text,
+    model_id,
+    voice_id,
+    voice_settings,
+    optimize_streaming_latency,
+    output_format,
+    use_cache=True,
+    max_workers=LONG_FORM_MAX_WORKERS,
+    user="anonymous",
+    priority="interactive"
+    ):
+    # splits the text within the model's character limit, renders the segments concurrently and yields
+    # their audio in order; join_segments() stitches them (mp3 frames / raw pcm samples)
+    segments = split_text(text, model_max_characters(model_id))
+    def synthesize_segment(segment):
+        audio_data, _ = synthesize_audio(
+            text=segment,
+            model_id=model_id,
+            voice_id=voice_id,
+            voice_settings=voice_settings,
+            optimize_streaming_latency=optimize_streaming_latency,
+            output_format=output_format,
+            use_cache=use_cache,
+            user=user,
+            priority=priority
+            )
+        return audio_data
+    yield from synthesize_in_order(segments, synthesize_segment, max_workers=max_workers)
+
+def text_to_speech_long_form(
+    text,
+    model_id,
+    voice_id,
+    voice_settings,
+    optimize_streaming_latency,
+    output_format,
+    use_cache=True,
+    max_workers=LONG_FORM_MAX_WORKERS,
+    user="anonymous"
+    ):
+    # generator for the streaming output : yields (audio_chunk, status) as soon as the next segment in order is ready,
+    # the chunks are join_segments() payloads (raw samples for pcm / ulaw)
+    if not model_id or not voice_id:
+        print("Model ID or Voice ID not selected.")
+        yield None, "Model ID or Voice ID not selected."
+        return
+    start = time.perf_counter()
+    count = 0
+    try:
+        for audio_data in iter_long_form_audio(text, model_id, voice_id, voice_settings, optimize_streaming_latency, output_format, use_cache, max_workers, user):
+            count += 1
+            yield segment_payload(audio_data, output_format), f"Segment {count} ready ({time.perf_counter() - start:.2f}s)"
+        yield None, f"TTS Successfull ({count} segments in {time.perf_counter() - start:.2f}s)."
+
+    except BudgetExceeded as e:
+        print(e)
+        yield None, str(e)
+
+    except requests.exceptions.HTTPError as http_err:
+        print(f"HTTP error occurred: {http_err}")
+        yield None, f"HTTP error occurred: {http_err}"
+
+    except requests.exceptions.RequestException as err:
+        print(f"Error occurred: {err}")
+        yield None, f"Error occurred: {err}"
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        yield None, f"An error occurred: {e}"
+
+def text_to_speech_stream(
+    text,
+    model_id,
+    voice_id,
+    voice_settings,
+    optimize_streaming_latency,
+    output_format,
+    use_cache=True,
+    chunk_size=STREAM_CHUNK_SIZE,
+    user="anonymous",
+    priority="interactive",
+    coalesce=True
+    ):
+    # generator version of text_to_speech : yields (audio_chunk, status) as soon as the stream endpoint sends audio,
+    # the chunks are the upstream bytes as they come (headerless for pcm / ulaw), the API streams them as is
+    url = f"text-to-speech/{voice_id}/stream"
+
+    querystring = {
+        "optimize_streaming_latency":optimize_streaming_latency,
+        "output_format":output_format
+        }
+    payload = {
+        "text": text,
+        "model_id": model_id,
+        "voice_settings": voice_settings
+    }
+    headers = {
+        "Accept": accept_header(output_format),
+        "Content-Type": "application/json"
+    }
+    if not model_id or not voice_id:
+        print("Model ID or Voice ID not selected.")
+        yield None, "Model ID or Voice ID not selected."
+        return
+    cache_key = make_cache_key(
+        text=text,
+        model_id=model_id,
+        voice_id=voice_id,
+        voice_settings=voice_settings,
+        output_format=output_format
+        )
+    if use_cache:
+        audio_data = tts_cache.get(cache_key)
+        if audio_data is not None:
+            print("Loaded TTS from cache.")
+            record_synthesis("elevenlabs_stream", len(text), len(audio_data), cache_hit=True)
+            yield audio_data, f"TTS Successfull (cache hit, {tts_cache_status()})."
+            return
+    make_stream = lambda: stream_audio(url, payload, headers, querystring, output_format, chunk_size, cache_key, use_cache, user, estimate_cost(text, model_id), priority)
+    if not coalesce:
+        yield from make_stream()
+        return
+    # identical streams in flight share one upstream request, fanned out to every caller
+    yield from in_flight.stream(("stream", cache_key, optimize_streaming_latency, priority), make_stream)
+
+def stream_audio(url, payload, headers, querystring, output_format, chunk_size, cache_key, use_cache, user="anonymous", cost=0, priority="interactive"):
+    # the upstream stream behind text_to_speech_stream : yields (audio_chunk, status), the audio is written to the cache
+    text = payload["text"]
+    timings = {}
+    start = time.perf_counter()
+    try:
+        with scheduler.slot(user, cost, priority), client.post(url, json=payload, headers=headers, params=querystring, stream=True) as response:
+            response.raise_for_status()  # This will raise an exception for HTTP error codes
+            timings["headers"] = time.perf_counter() - start
+            audio_data = bytearray()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                if not audio_data:
+                    timings["first_byte"] = time.perf_counter() - start
+                audio_data += chunk
+                if "first_frame" not in timings and first_playable_offset(audio_data, output_format) is not None:
+                    timings["first_frame"] = time.perf_counter() - start
+                yield bytes(chunk), f"Streaming... {len(audio_data)} bytes received"
+        timings["total"] = time.perf_counter() - start
+        for stage, seconds in timings.items():
+            metrics.observe("tts_stage_seconds", seconds, provider="elevenlabs_stream", stage=stage)
+        record_synthesis("elevenlabs_stream", len(text), len(audio_data), cache_hit=False if use_cache else None)
+        with stage_timer("elevenlabs_stream", "cache_write"):
+            tts_cache.put(cache_key, audio_data)
+        print(f"Stream finished : {stream_timings_status(timings)}")
+        yield None, f"TTS Successfull ({stream_timings_status(timings)})."
+
+    except BudgetExceeded as e:
+        print(e)
+        yield None, str(e)
+
+    except requests.exceptions.HTTPError as http_err:
+        print(f"HTTP error occurred: {http_err}")
+        print(f"Response status code: {response.status_code}")
+        print(f"Response text: {response.text}")
+        metrics.inc("tts_errors_total", provider="elevenlabs_stream")
+        yield None, f"HTTP error occurred: {http_err}"
+
+    except requests.exceptions.RequestException as err:
+        print(f"Error occurred: {err}")
+        metrics.inc("tts_errors_total", provider="elevenlabs_stream")
+        yield None, f"Error occurred: {err}"
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        metrics.inc("tts_errors_total", provider="elevenlabs_stream")
+        yield None, f"An error occurred: {e}"
+
+async def text_to_speech_stream_input(
+    fragments,
+    model_id,
+    voice_id,
+    voice_settings,
+    output_format,
+    chunk_length_schedule=None,
+    flush=STREAM_INPUT_FLUSH
+    ):
+    # input streaming : fragments is an async iterator of text (LLM tokens...), yields (audio_chunk, status)
+    # while the text is still coming in. Not cached nor scheduled, the full text and its cost are unknown up front
+    if not model_id or not voice_id:
+        print("Model ID or Voice ID not selected.")
+        yield None, "Model ID or Voice ID not selected."
+        return
+    received = 0
+    try:
+        async for chunk in synthesize_stream_input(
+            client,
+            fragments,
+            voice_id,
+            model_id,
+            voice_settings=voice_settings,
+            output_format=output_format,
+            chunk_length_schedule=chunk_length_schedule or STREAM_INPUT_SCHEDULE,
+            flush_sentences=flush
+            ):
+            received += len(chunk)
+            yield chunk, f"Streaming... {received} bytes received"
+        yield None, "TTS Successfull (stream-input)."
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        metrics.inc("tts_errors_total", provider="elevenlabs_ws")
+        yield None, f"An error occurred: {e}"
+
+def stream_timings_status(timings):
+    return ", ".join(f"{name}: {value * 1000:.0f} ms" for name, value in timings.items())
+
+def resilience_status():
+    metrics = client.resilience_metrics()
+    return f"concurrency limit: {metrics['concurrency_limit']}, retries: {metrics['retries']}, throttled: {metrics['throttled']}, throttle time: {metrics['throttle_seconds']:.1f}s"
+
+def tts_cache_status():
+    stats = tts_cache.stats()
+    return f"hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hit_rate']:.0%}"
     
     
 def get_models_drop_down(new_models=[]):
     global models
+    load_catalog()
     if len(new_models) > 0:
         models = new_models
-    models_list = []
-    for model in models:
-        models_list.append((model["name"], model["model_id"]))
-    return gr.Dropdown(choices=models_list, label="Select Model", allow_custom_value=True, scale=9, interactive=True)
+        catalog.rebuild(models=models)
+    return gr.Dropdown(choices=catalog.model_choices(), label="Select Model", allow_custom_value=True, scale=9, interactive=True)
     
 def get_voices_drop_down(new_voices=[]):
     global voices
+    load_catalog()
     if len(new_voices) > 0:
         voices = new_voices
-    voice_list = []
-    for voice in voices:
-        voice_list.append((voice["name"], voice["voice_id"]))
-    return gr.Dropdown(choices=voice_list, label="Select Voice", allow_custom_value=True, scale=9, interactive=True)    
+        catalog.rebuild(voices=voices)
+    return gr.Dropdown(choices=catalog.voice_choices(), label="Select Voice", allow_custom_value=True, scale=9, interactive=True)    
+
+def request_user(request):
+    # who the scheduler bills : the logged in user when the app has auth, the client address otherwise
+    if request is None:
+        return "anonymous"
+    return request.username or (request.client.host if request.client else "anonymous")
+
+def filter_voices_drop_down(accent, gender, age, use_case):
+    matches = load_catalog().find_voices(accent=accent, gender=gender, age=age, use_case=use_case)
+    return gr.Dropdown(choices=[(voice["name"], voice["voice_id"]) for voice in matches])
     
 with gr.Blocks() as demo:
     with gr.Row():
@@ -337,6 +686,7 @@ with gr.Blocks() as demo:
         def update_api_key_value(new_api_key):
             global api_key
             api_key = new_api_key
+            client.api_key = new_api_key
             print("API Key updated successfully.")
         update_api_key.click(
             update_api_key_value,
@@ -351,14 +701,13 @@ with gr.Blocks() as demo:
         with gr.Column(scale=5):
             with gr.Accordion(label="Models / Voices",open=True) as acc:
                 with gr.Row():
-                    models_list = get_models_drop_down()
+                    # filled on page load, building the UI doesn't wait for the catalog
+                    models_list = gr.Dropdown(choices=[], label="Select Model", allow_custom_value=True, scale=9, interactive=True)
                     get_models_btn = gr.Button("Get Models", scale=1)
                     def get_models(use_cache):
-                        global models
-                        if use_cache :
-                            return models
-                        save_models() # will change the global voices variable
-                        return models
+                        if not use_cache :
+                            catalog_refresher.request_refresh() # refreshed in the background, the handler doesn't wait
+                        return get_models_drop_down()
 
                     get_models_btn.click(
                         get_models,
@@ -366,20 +715,29 @@ with gr.Blocks() as demo:
                         outputs=[models_list],
                         )
                 with gr.Row():
-                    voice_list = get_voices_drop_down()
+                    voice_list = gr.Dropdown(choices=[], label="Select Voice", allow_custom_value=True, scale=9, interactive=True)
                     get_voices_btn = gr.Button("Get Voices", scale=1)
                     def get_voices(use_cache):
-                        global voices
-                        if use_cache :
-                            return voices
-                        save_voices() # will change the global voices variable
-                        return voices
+                        if not use_cache :
+                            catalog_refresher.request_refresh()
+                        return get_voices_drop_down()
                     
                     get_voices_btn.click(
                         get_voices,
                         inputs=[use_cache_checkbox],
                         outputs=[voice_list],
                         )
+                with gr.Row():
+                    voice_filters = [
+                        gr.Dropdown(choices=[], label=f"Filter by {field.replace('_', ' ')}", interactive=True)
+                        for field in LABEL_FIELDS
+                        ]
+                    for voice_filter in voice_filters:
+                        voice_filter.change(
+                            filter_voices_drop_down,
+                            inputs=voice_filters,
+                            outputs=[voice_list],
+                            )
                 with gr.Row():
                     voice_information_display = gr.Textbox(value="Select a voice to view information", label="Voice Information", interactive=False)
                     voice_audio_preview = gr.Audio( label="Voice Preview", interactive=False)
@@ -390,7 +748,10 @@ with gr.Blocks() as demo:
                     )
                 with gr.Row():
                     with gr.Accordion(label="Voice Settings", open=True):
-                        load_voice_settings_btn = gr.Button("Load Voice Settings")
+                        with gr.Row():
+                            load_voice_settings_btn = gr.Button("Load Voice Settings")
+                            prefetch_voice_settings_btn = gr.Button("Prefetch All Voice Settings")
+                        voice_settings_status_display = gr.Textbox(label="Voice Settings Cache", value=voice_settings_status, interactive=False)
                         stability_input = gr.Slider(label="Stability", minimum=0, maximum=5, step=0.1, value=0.5, interactive=True)
                         similarity_boost_input = gr.Slider(label="Similarity Boost", minimum=0, maximum=5, step=0.1, value=0.75, interactive=True)
                         style_input = gr.Slider(label="Style", minimum=0, maximum=5, step=0.1, value=0, interactive=True)
@@ -410,6 +771,14 @@ with gr.Blocks() as demo:
                             load_voice_settings_values,
                             inputs=[voice_list, use_cache_checkbox],
                             outputs=[stability_input, similarity_boost_input, style_input, use_speaker_boost_checkbox],
+                        ).then(voice_settings_status, outputs=[voice_settings_status_display])
+                        def prefetch_voice_settings_values(use_cache):
+                            prefetch_voice_settings(refresh=not use_cache, background=False)
+                            return voice_settings_status()
+                        prefetch_voice_settings_btn.click(
+                            prefetch_voice_settings_values,
+                            inputs=[use_cache_checkbox],
+                            outputs=[voice_settings_status_display],
                         )
                      
             with gr.Accordion(label="Text-to-Speech", open=True):
@@ -419,6 +788,8 @@ with gr.Blocks() as demo:
                 
         with gr.Column(scale=5):
             voice_output = gr.Audio(label="Voice Output")
+            # Gradio's conversion of the returned bytes (decode / re-encode to a served file) is a stage of its own
+            voice_output.postprocess = metrics.timed(voice_output.postprocess, "tts_stage_seconds", provider="elevenlabs", stage="gradio_postprocess")
             voice_output_status = gr.Textbox(label="Voice Output Status", interactive=False)
             generate_tts_btn = gr.Button("Generate TTS")
             def generate_tts_wrapper(
@@ -430,7 +801,9 @@ with gr.Blocks() as demo:
                     style_input,
                     use_speaker_boost_checkbox,
                     optimize_streaming_latency,
-                    output_format
+                    output_format,
+                    use_cache,
+                    request: gr.Request
                 ):
                 voice_settings = {
                     "stability": stability_input,
@@ -444,7 +817,9 @@ with gr.Blocks() as demo:
                     voice_id=voice_id,
                     voice_settings=voice_settings,
                     optimize_streaming_latency=optimize_streaming_latency,
-                    output_format=output_format
+                    output_format=output_format,
+                    use_cache=use_cache,
+                    user=request_user(request)
                     )
                 
             generate_tts_btn.click(
@@ -458,12 +833,192 @@ with gr.Blocks() as demo:
                     style_input, 
                     use_speaker_boost_checkbox, 
                     optimize_streaming_latency_input, 
-                    output_format
+                    output_format,
+                    use_cache_checkbox
                     ],
                 outputs=[voice_output, voice_output_status],
             )
+            voice_stream_output = gr.Audio(label="Voice Output (Streaming)", streaming=True, autoplay=True, interactive=False)
+            with gr.Row():
+                generate_tts_stream_btn = gr.Button("Stream TTS")
+                generate_tts_long_form_btn = gr.Button("Long-form TTS")
+                generate_tts_stream_input_btn = gr.Button("Stream Input TTS")
+            def generate_tts_stream_wrapper(
+                    text,
+                    model_id,
+                    voice_id,
+                    stability_input,
+                    similarity_boost_input,
+                    style_input,
+                    use_speaker_boost_checkbox,
+                    optimize_streaming_latency,
+                    output_format,
+                    use_cache,
+                    request: gr.Request
+                ):
+                voice_settings = {
+                    "stability": stability_input,
+                    "similarity_boost": similarity_boost_input,
+                    "style": style_input,
+                    "use_speaker_boost": use_speaker_boost_checkbox,
+                }
+                player = PlayableChunks(output_format) # raw pcm / ulaw chunks (and cache hits) go to the player as wav
+                for chunk, status in text_to_speech_stream(
+                    text=text,
+                    model_id=model_id,
+                    voice_id=voice_id,
+                    voice_settings=voice_settings,
+                    optimize_streaming_latency=optimize_streaming_latency,
+                    output_format=output_format,
+                    use_cache=use_cache,
+                    user=request_user(request)
+                    ):
+                    yield player.feed(chunk), status
+
+            generate_tts_stream_btn.click(
+                generate_tts_stream_wrapper,
+                inputs=[
+                    text, 
+                    models_list, 
+                    voice_list, 
+                    stability_input, 
+                    similarity_boost_input, 
+                    style_input, 
+                    use_speaker_boost_checkbox, 
+                    optimize_streaming_latency_input, 
+                    output_format,
+                    use_cache_checkbox
+                    ],
+                outputs=[voice_stream_output, voice_output_status],
+            )
+            def generate_tts_long_form_wrapper(
+                    text,
+                    model_id,
+                    voice_id,
+                    stability_input,
+                    similarity_boost_input,
+                    style_input,
+                    use_speaker_boost_checkbox,
+                    optimize_streaming_latency,
+                    output_format,
+                    use_cache,
+                    request: gr.Request
+                ):
+                voice_settings = {
+                    "stability": stability_input,
+                    "similarity_boost": similarity_boost_input,
+                    "style": style_input,
+                    "use_speaker_boost": use_speaker_boost_checkbox,
+                }
+                player = PlayableChunks(output_format) # raw pcm / ulaw segments go to the player as wav
+                for chunk, status in text_to_speech_long_form(
+                    text=text,
+                    model_id=model_id,
+                    voice_id=voice_id,
+                    voice_settings=voice_settings,
+                    optimize_streaming_latency=optimize_streaming_latency,
+                    output_format=output_format,
+                    use_cache=use_cache,
+                    user=request_user(request)
+                    ):
+                    yield player.feed(chunk), status
+
+            generate_tts_long_form_btn.click(
+                generate_tts_long_form_wrapper,
+                inputs=[
+                    text, 
+                    models_list, 
+                    voice_list, 
+                    stability_input, 
+                    similarity_boost_input, 
+                    style_input, 
+                    use_speaker_boost_checkbox, 
+                    optimize_streaming_latency_input, 
+                    output_format,
+                    use_cache_checkbox
+                    ],
+                outputs=[voice_stream_output, voice_output_status],
+            )
+            async def generate_tts_stream_input_wrapper(
+                    text,
+                    model_id,
+                    voice_id,
+                    stability_input,
+                    similarity_boost_input,
+                    style_input,
+                    use_speaker_boost_checkbox,
+                    output_format
+                ):
+                voice_settings = {
+                    "stability": stability_input,
+                    "similarity_boost": similarity_boost_input,
+                    "style": style_input,
+                    "use_speaker_boost": use_speaker_boost_checkbox,
+                }
+                # the text box replayed word by word, the way an LLM would hand over its tokens
+                player = PlayableChunks(output_format) # raw pcm / ulaw chunks go to the player as wav
+                async for chunk, status in text_to_speech_stream_input(
+                    fragments=iterate_fragments(text, delay=0.02),
+                    model_id=model_id,
+                    voice_id=voice_id,
+                    voice_settings=voice_settings,
+                    output_format=output_format
+                    ):
+                    yield player.feed(chunk), status
+
+            generate_tts_stream_input_btn.click(
+                generate_tts_stream_input_wrapper,
+                inputs=[
+                    text,
+                    models_list,
+                    voice_list,
+                    stability_input,
+                    similarity_boost_input,
+                    style_input,
+                    use_speaker_boost_checkbox,
+                    output_format
+                    ],
+                outputs=[voice_stream_output, voice_output_status],
+            )
+    with gr.Accordion(label="Diagnostics", open=False):
+        diagnostics_display = gr.Textbox(label="Stage timings and counters", lines=12, interactive=False)
+        with gr.Row():
+            refresh_diagnostics_btn = gr.Button("Refresh Diagnostics")
+            reset_diagnostics_btn = gr.Button("Reset Diagnostics")
+        refresh_diagnostics_btn.click(metrics.summary, outputs=[diagnostics_display])
+        def reset_diagnostics():
+            metrics.reset()
+            return metrics.summary()
+        reset_diagnostics_btn.click(reset_diagnostics, outputs=[diagnostics_display])
+    def fill_catalog_choices():
+        load_catalog()
+        return (
+            get_models_drop_down(),
+            get_voices_drop_down(),
+            *[gr.Dropdown(choices=catalog.label_values(field)) for field in LABEL_FIELDS],
+            )
+    demo.load(fill_catalog_choices, outputs=[models_list, voice_list, *voice_filters])
+    
+def warm_up():
+    # what the first requests need, loaded while the server is already accepting connections
+    load_catalog()
+    voice_settings_store.ensure_loaded()
+    prefetch_voice_settings() # fetches the missing voice settings in the background
+    if os.getenv("prewarm_plan"):
+        # known phrases rendered into the synthesis cache at batch priority, live requests go first
+        plan = prewarm.load_plan(os.getenv("prewarm_plan"))
+        prewarm.prewarm(
+            prewarm.elevenlabs_entries(sys.modules[__name__], plan),
+            workers=int(os.getenv("prewarm_workers", 4)),
+            rate=float(os.getenv("prewarm_rate", 2)),
+            )
     
 def main():
+    metrics_port = os.getenv("metrics_port")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+    catalog_refresher.start()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
     demo.queue(default_concurrency_limit=None).launch()
     
 if __name__ == "__main__":
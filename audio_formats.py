@@ -0,0 +1,176 @@
+import io
+import struct
+import wave
+
+import numpy as np
+
+# helpers to reason about the raw audio returned by the TTS providers (mp3 frames, pcm / ulaw samples)
+
+MP3_BITRATES = {
+    # (mpeg version 1, layer III) / (mpeg version 2 & 2.5, layer III), kbps, index 0 = free, 15 = bad
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0],
+}
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000], # mpeg 1
+    2: [22050, 24000, 16000], # mpeg 2
+    0: [11025, 12000, 8000], # mpeg 2.5
+}
+ACCEPT_HEADERS = {"mp3": "audio/mpeg", "pcm": "audio/pcm", "ulaw": "audio/basic"}
+
+
+def parse_output_format(output_format):
+    # "mp3_44100_128" -> ("mp3", 44100, 128), "pcm_16000" -> ("pcm", 16000, None)
+    parts = (output_format or "mp3_44100_128").split("_")
+    codec = parts[0]
+    sample_rate = int(parts[1]) if len(parts) > 1 else None
+    bitrate = int(parts[2]) if len(parts) > 2 else None
+    return codec, sample_rate, bitrate
+
+
+def accept_header(output_format):
+    codec, _, _ = parse_output_format(output_format)
+    return ACCEPT_HEADERS.get(codec, "audio/mpeg")
+
+
+def pcm_array(data, output_format):
+    # (sample rate, S16LE samples) as Gradio takes them, viewing data's buffer : no copy and no decoding.
+    # Read-only so that data (possibly a cached bytes object) isn't changed through the array
+    _, sample_rate, _ = parse_output_format(output_format)
+    samples = np.frombuffer(data, dtype="<i2", count=len(data) // 2)
+    samples.flags.writeable = False
+    return sample_rate, samples
+
+
+def id3_size(data, offset=0):
+    # size of an ID3v2 tag starting at offset (0 if there is none)
+    if len(data) - offset < 10 or data[offset:offset + 3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[offset + 6:offset + 10]:
+        size = (size << 7) | (byte & 0x7F)
+    return 10 + size
+
+
+def mp3_frame_length(data, offset):
+    # length of the mp3 (layer III) frame whose header starts at offset, None if it isn't a valid header
+    if len(data) - offset < 4:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    padding = (b2 >> 1) & 0x01
+    bitrate = MP3_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    coefficient = 144 if version == 3 else 72
+    return coefficient * bitrate // sample_rate + padding
+
+
+def iter_mp3_frames(data):
+    # yields (offset, length) of every mp3 frame, skipping ID3 tags and junk between frames
+    offset = id3_size(data)
+    size = len(data)
+    while offset < size - 3:
+        length = mp3_frame_length(data, offset)
+        if length is None:
+            tag = id3_size(data, offset)
+            offset += tag if tag else 1
+            continue
+        if offset + length > size:
+            return
+        yield offset, length
+        offset += length
+
+
+def first_playable_offset(data, output_format):
+    # number of bytes needed before the first frame / sample of the stream can be played, None if not yet
+    codec, _, _ = parse_output_format(output_format)
+    if codec == "pcm":
+        return 2 if len(data) >= 2 else None
+    if codec == "ulaw":
+        return 1 if len(data) >= 1 else None
+    for offset, length in iter_mp3_frames(data):
+        return offset + length
+    return None
+
+
+
+def mp3_frames(data):
+    # the mp3 frames of data without ID3 tags or trailing junk, so that several mp3 responses can be concatenated
+    view = memoryview(data)
+    return b"".join(view[offset:offset + length] for offset, length in iter_mp3_frames(data))
+
+
+def segment_payload(data, output_format):
+    # the part of one synthesized segment that can be appended to the previous ones
+    codec, _, _ = parse_output_format(output_format)
+    if codec == "mp3":
+        return mp3_frames(data)
+    if codec == "pcm" and len(data) % 2:
+        return bytes(data[:-1]) # never let a segment shift the S16LE sample alignment
+    return bytes(data)
+
+
+def join_segments(segments, output_format):
+    # mp3 : frame concatenation, pcm / ulaw : raw sample concatenation (headerless formats)
+    return b"".join(segment_payload(segment, output_format) for segment in segments)
+
+
+def wav_file(data, output_format):
+    # raw pcm (S16LE) / ulaw samples under a mono wav header, for players that need an encoded file
+    codec, sample_rate, _ = parse_output_format(output_format)
+    format_tag, sample_width = (7, 1) if codec == "ulaw" else (1, 2)
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(data), b"WAVE",
+        b"fmt ", 16, format_tag, 1, sample_rate, sample_rate * sample_width, sample_width, 8 * sample_width,
+        b"data", len(data),
+        )
+    return header + bytes(data)
+
+
+class PlayableChunks:
+    # the streaming gr.Audio takes every chunk as a whole encoded file : mp3 chunks pass as they are, raw
+    # pcm / ulaw ones get a wav header each, pcm cut on sample boundaries (an odd byte waits for the next chunk)
+    def __init__(self, output_format):
+        self.output_format = output_format
+        self.codec = parse_output_format(output_format)[0]
+        self._pending = b""
+
+    def feed(self, chunk):
+        # the chunk to yield to the player, None when nothing is playable yet
+        if chunk is None or self.codec not in ("pcm", "ulaw"):
+            return chunk
+        data = self._pending + bytes(chunk)
+        cut = len(data) - len(data) % 2 if self.codec == "pcm" else len(data)
+        data, self._pending = data[:cut], data[cut:]
+        return wav_file(data, self.output_format) if data else None
+
+
+def join_wav(parts):
+    # concatenates the samples of several wav files with the same parameters into one wav file
+    output = io.BytesIO()
+    writer = None
+    for part in parts:
+        with wave.open(io.BytesIO(part), "rb") as reader:
+            if writer is None:
+                writer = wave.open(output, "wb")
+                writer.setparams(reader.getparams())
+            writer.writeframes(reader.readframes(reader.getnframes()))
+    if writer is None:
+        return b""
+    writer.close()
+    return output.getvalue()
+
+
+def join_audio(parts, codec):
+    # "wav" parts are re-muxed under one header, headerless mp3 parts (gTTS) are appended as gTTS itself does
+    if codec == "wav":
+        return join_wav(parts)
+    return b"".join(parts)
@@ -0,0 +1,163 @@
+import argparse
+import importlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from audio_formats import join_segments
+from file_utils import write_atomic
+from tts_metrics import percentile
+from tts_cache import make_cache_key
+
+# offline batch synthesis over a JSONL job file, one job per line :
+# {"text": "...", "voice_id": "...", "model_id": "...", "settings": {...}, "format": "mp3_44100_128", "output": "out/1.mp3"}
+# usage : python batch_synthesis.py jobs.jsonl --workers 8
+
+DEFAULT_FORMAT = "mp3_44100_128"
+DEFAULT_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.75,
+    "style": 0,
+    "use_speaker_boost": True
+}
+
+
+def load_jobs(jobs_path):
+    jobs = []
+    with open(jobs_path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            if not job.get("text") or not job.get("voice_id") or not job.get("model_id") or not job.get("output"):
+                raise ValueError(f"Job on line {line_number} needs text, voice_id, model_id and output")
+            job.setdefault("settings", DEFAULT_SETTINGS)
+            job.setdefault("format", DEFAULT_FORMAT)
+            job.setdefault("id", job_key(job))
+            jobs.append(job)
+    return jobs
+
+
+def job_key(job):
+    return make_cache_key(
+        text=job["text"],
+        model_id=job["model_id"],
+        voice_id=job["voice_id"],
+        voice_settings=job.get("settings"),
+        output_format=job.get("format"),
+        output=job["output"]
+        )
+
+
+class Checkpoint:
+    # append-only log of finished job ids, flushed after every job so a crashed run can resume
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.done = {line.strip() for line in file if line.strip()}
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, job):
+        return job["id"] in self.done and os.path.exists(job["output"])
+
+    def mark_done(self, job):
+        with self._lock:
+            self.done.add(job["id"])
+            self._file.write(f"{job['id']}\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def run_job(elevenlabs, job, optimize_streaming_latency, use_cache):
+    start = time.perf_counter()
+    segments = elevenlabs.iter_long_form_audio(
+        text=job["text"],
+        model_id=job["model_id"],
+        voice_id=job["voice_id"],
+        voice_settings=job["settings"],
+        optimize_streaming_latency=optimize_streaming_latency,
+        output_format=job["format"],
+        use_cache=use_cache,
+        max_workers=1, # the batch runner already parallelizes across jobs
+        user=job.get("user", "batch"),
+        priority="batch" # yields to interactive requests sharing the scheduler
+        )
+    write_atomic(job["output"], join_segments(segments, job["format"]))
+    return time.perf_counter() - start
+
+
+def run_batch(jobs_path, workers=4, checkpoint_path=None, optimize_streaming_latency=0, use_cache=True):
+    elevenlabs = importlib.import_module("11labs_example")
+    jobs = load_jobs(jobs_path)
+    checkpoint = Checkpoint(checkpoint_path or f"{jobs_path}.done")
+    pending = [job for job in jobs if not checkpoint.is_done(job)]
+    skipped = len(jobs) - len(pending)
+    if skipped:
+        print(f"Resuming : {skipped} jobs already done")
+    latencies = []
+    failed = 0
+    characters = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_job, elevenlabs, job, optimize_streaming_latency, use_cache): job for job in pending}
+            for count, future in enumerate(as_completed(futures), start=1):
+                job = futures[future]
+                try:
+                    latency = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"[{count}/{len(pending)}] failed {job['output']} : {e}")
+                    continue
+                checkpoint.mark_done(job)
+                latencies.append(latency)
+                characters += len(job["text"])
+                print(f"[{count}/{len(pending)}] {job['output']} ({latency:.2f}s)")
+    finally:
+        checkpoint.close()
+    elapsed = time.perf_counter() - start
+    report = {
+        "jobs": len(jobs),
+        "skipped": skipped,
+        "succeeded": len(latencies),
+        "failed": failed,
+        "elapsed_seconds": elapsed,
+        "jobs_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "chars_per_second": characters / elapsed if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies, default=0.0),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthesize a JSONL file of ElevenLabs TTS jobs")
+    parser.add_argument("jobs", help="JSONL file with one job per line")
+    parser.add_argument("--workers", type=int, default=4, help="number of jobs synthesized concurrently")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: <jobs>.done)")
+    parser.add_argument("--optimize-streaming-latency", type=int, default=0)
+    parser.add_argument("--no-cache", action="store_true", help="don't read from the synthesis cache")
+    args = parser.parse_args()
+    report = run_batch(
+        args.jobs,
+        workers=args.workers,
+        checkpoint_path=args.checkpoint,
+        optimize_streaming_latency=args.optimize_streaming_latency,
+        use_cache=not args.no_cache
+        )
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_servers import start_mock_server
+from tts_metrics import percentile
+
+# drives text_to_speech / google_tts / pyttsx3_tts against local stand-in servers across concurrency
+# levels and text lengths and writes a machine-readable report to compare versions :
+# python benchmark.py --concurrency 1,4,16 --lengths 100,1000 --output benchmark_results.json
+
+SAMPLE_TEXT = "Did you know that honeybees, a vital part of our agricultural ecosystem, are responsible for pollinating approximately one-third of the food crops we consume? "
+VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.75,
+    "style": 0,
+    "use_speaker_boost": True
+}
+
+
+def make_text(length):
+    return (SAMPLE_TEXT * (length // len(SAMPLE_TEXT) + 1))[:length]
+
+
+def peak_rss_bytes():
+    # peak resident set size of this process and of the worker processes it waited for, None where unsupported
+    try:
+        import resource
+    except ImportError:
+        return None
+    scale = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is in bytes on macOS, kilobytes on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def elevenlabs_call(elevenlabs, text, stream):
+    # returns (time to first byte, total time)
+    start = time.perf_counter()
+    if stream:
+        first_byte = None
+        for chunk, status in elevenlabs.text_to_speech_stream(text, "eleven_multilingual_v2", "onwK4e9ZLuTAKqWW03F9", VOICE_SETTINGS, 1, "mp3_44100_128", use_cache=False, coalesce=False):
+            if chunk is None and not status.startswith("TTS Successfull"):
+                raise RuntimeError(status)
+            if chunk is not None and first_byte is None:
+                first_byte = time.perf_counter() - start
+        return first_byte, time.perf_counter() - start
+    audio_data, status = elevenlabs.text_to_speech(text, "eleven_multilingual_v2", "onwK4e9ZLuTAKqWW03F9", VOICE_SETTINGS, 1, "mp3_44100_128", use_cache=False, coalesce=False)
+    if audio_data is None:
+        raise RuntimeError(status)
+    total = time.perf_counter() - start
+    return total, total
+
+
+def load_targets(names):
+    targets = {}
+    if "elevenlabs" in names or "elevenlabs_stream" in names:
+        elevenlabs = importlib.import_module("11labs_example")
+        targets["elevenlabs"] = lambda text: elevenlabs_call(elevenlabs, text, stream=False)
+        targets["elevenlabs_stream"] = lambda text: elevenlabs_call(elevenlabs, text, stream=True)
+    if "gtts" in names or "pyttsx3" in names:
+        gtts_example = importlib.import_module("gtts_example")
+        def timed(function, *args):
+            start = time.perf_counter()
+            function(*args)
+            total = time.perf_counter() - start
+            return total, total # buffered providers : the first byte is the whole answer
+        # every request is its own upstream call : concurrent identical texts must not be merged by single flight
+        targets["gtts"] = lambda text: timed(gtts_example.google_tts, text, "en", False)
+        targets["pyttsx3"] = lambda text: timed(gtts_example.pyttsx3_tts, text, None)
+    return {name: target for name, target in targets.items() if name in names}
+
+
+def run_scenario(target, text, concurrency, requests_count):
+    first_bytes = []
+    latencies = []
+    errors = []
+    def call(_):
+        try:
+            return target(text)
+        except Exception as e:
+            errors.append(str(e))
+            return None
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for result in executor.map(call, range(requests_count)):
+            if result is not None:
+                first_byte, total = result
+                if first_byte is not None:
+                    first_bytes.append(first_byte)
+                latencies.append(total)
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests_count,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "throughput_chars_per_second": len(latencies) * len(text) / elapsed if elapsed else 0.0,
+        "ttfb_p50": percentile(first_bytes, 50),
+        "ttfb_p95": percentile(first_bytes, 95),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies, default=0.0),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TTS paths against local stand-in servers")
+    parser.add_argument("--providers", default="elevenlabs,elevenlabs_stream,gtts,pyttsx3")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--lengths", default="100,1000", help="comma separated text lengths in characters")
+    parser.add_argument("--requests", type=int, default=0, help="requests per scenario (default: 4 x concurrency, at least 8)")
+    parser.add_argument("--latency", type=float, default=0.1, help="mock server time to first byte, seconds")
+    parser.add_argument("--throughput", type=int, default=500_000, help="mock server audio bytes per second, 0 for unlimited")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    server = start_mock_server(latency=args.latency, throughput=args.throughput)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    # must be set before the apps are imported, their clients read them at import time
+    os.environ["elevenlabs_base_url"] = f"{base_url}/v1"
+    os.environ["gtts_base_url"] = base_url
+    os.environ.setdefault("11labs_api_key", "benchmark")
+
+    names = [name.strip() for name in args.providers.split(",") if name.strip()]
+    targets = load_targets(names)
+    results = []
+    for name, target in targets.items():
+        for length in [int(value) for value in args.lengths.split(",")]:
+            text = make_text(length)
+            for concurrency in [int(value) for value in args.concurrency.split(",")]:
+                requests_count = args.requests or max(8, concurrency * 4)
+                result = run_scenario(target, text, concurrency, requests_count)
+                result.update({"provider": name, "text_length": length, "concurrency": concurrency})
+                results.append(result)
+                print(f"{name:18} len={length:<6} c={concurrency:<3} p50={result['latency_p50'] * 1000:8.1f} ms  p95={result['latency_p95'] * 1000:8.1f} ms  ttfb p50={result['ttfb_p50'] * 1000:8.1f} ms  {result['throughput_rps']:7.2f} req/s  errors={result['errors']}")
+    server.shutdown()
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "mock_server": {"latency": args.latency, "throughput": args.throughput},
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=4)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
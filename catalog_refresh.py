@@ -0,0 +1,177 @@
+import hashlib
+import json
+import random
+import threading
+import time
+
+from file_utils import write_atomic
+
+
+class RefreshTarget:
+    __slots__ = ("name", "path", "file_path", "on_update", "etag", "last_modified", "content_hash", "last_refresh", "last_error")
+
+    def __init__(self, name, path, file_path, on_update):
+        self.name = name
+        self.path = path
+        self.file_path = file_path
+        self.on_update = on_update
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.last_refresh = None
+        self.last_error = None
+
+    def local_hash(self):
+        # hash of the file on disk, read on the first refresh rather than at startup
+        if self.content_hash is None:
+            try:
+                with open(self.file_path, "rb") as file:
+                    self.content_hash = hashlib.sha256(file.read()).hexdigest()
+            except OSError:
+                pass
+        return self.content_hash
+
+
+class CatalogRefresher:
+    # refreshes the voices / models catalogs in a background thread : conditional requests (ETag /
+    # If-Modified-Since, content hash when the API sends neither), atomic JSON writes and an on_update
+    # callback that swaps the in-memory catalog, so request handlers never wait on a fetch.
+    # With a SharedStore the processes of the host share one refresh instead of each calling the API
+    def __init__(self, client, interval=3600, jitter=0.2, shared_store=None):
+        self.client = client
+        self.shared_store = shared_store
+        self.interval = interval
+        self.jitter = jitter
+        self.targets = {}
+        self.refreshes = 0
+        self.not_modified = 0
+        self.errors = 0
+        self._forced = False
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add_target(self, name, path, file_path, on_update):
+        self.targets[name] = RefreshTarget(name, path, file_path, on_update)
+
+    def refresh(self, name, shared_max_age=None) -> bool:
+        # returns True when the catalog changed
+        target = self.targets[name]
+        with self._lock: # one refresh at a time, the scheduler and a manual refresh may race
+            if self.shared_store is None:
+                return self._fetch(name, target)
+            # one refresh at a time on the host too : a catalog another process refreshed less than
+            # shared_max_age seconds ago (half the interval by default) is adopted without an API call
+            if shared_max_age is None:
+                shared_max_age = self.interval / 2
+            with self.shared_store.lock(f"catalog-{name}"):
+                document = self.shared_store.get_document("catalog", name)
+                if document is not None and time.time() - document[1] < shared_max_age:
+                    return self._adopt(name, target, document[0].encode("utf-8"))
+                changed = self._fetch(name, target)
+                if target.last_error is None:
+                    self._publish(name, target)
+                return changed
+
+    def _fetch(self, name, target):
+        headers = {}
+        if target.etag:
+            headers["If-None-Match"] = target.etag
+        if target.last_modified:
+            headers["If-Modified-Since"] = target.last_modified
+        try:
+            response = self.client.get(target.path, headers=headers)
+            target.last_refresh = time.time()
+            target.last_error = None
+            if response.status_code == 304:
+                self.not_modified += 1
+                return False
+            response.raise_for_status()
+            target.etag = response.headers.get("ETag", target.etag)
+            target.last_modified = response.headers.get("Last-Modified", target.last_modified)
+            return self._apply(target, response.content)
+        except Exception as e:
+            self.errors += 1
+            target.last_error = str(e)
+            print(f"Warning : couldn't refresh {name} : {e}")
+            return False
+
+    def _apply(self, target, content):
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash == target.local_hash():
+            self.not_modified += 1
+            return False
+        data = json.loads(content)
+        write_atomic(target.file_path, content)
+        target.content_hash = content_hash
+        target.on_update(data) # builds the new catalog then swaps it in
+        self.refreshes += 1
+        return True
+
+    def _adopt(self, name, target, content):
+        try:
+            changed = self._apply(target, content)
+            target.last_refresh = time.time()
+            target.last_error = None
+            return changed
+        except Exception as e:
+            self.errors += 1
+            target.last_error = str(e)
+            print(f"Warning : couldn't adopt the shared {name} catalog : {e}")
+            return False
+
+    def _publish(self, name, target):
+        # the current file (fetched, or unchanged) for the other processes, with a fresh timestamp
+        try:
+            with open(target.file_path, "rb") as file:
+                self.shared_store.put_document("catalog", name, file.read().decode("utf-8"))
+        except Exception as e:
+            print(f"Warning : couldn't share the {name} catalog : {e}")
+
+    def refresh_all(self, shared_max_age=None):
+        return {name: self.refresh(name, shared_max_age) for name in self.targets}
+
+    def request_refresh(self):
+        # non blocking : wakes the background thread (starting it if needed); asked for explicitly, so a
+        # shared copy is only reused when it is a few seconds old
+        self._forced = True
+        self.start()
+        self._wake.set()
+
+    def _next_delay(self):
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(timeout=self._next_delay())
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            forced, self._forced = self._forced, False
+            self.refresh_all(shared_max_age=10 if forced else None)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self):
+        return {
+            "refreshes": self.refreshes,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "targets": {
+                name: {"last_refresh": target.last_refresh, "etag": target.etag, "last_error": target.last_error}
+                for name, target in self.targets.items()
+            },
+        }
@@ -0,0 +1,224 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from resilience import ResilienceMetrics, RetryPolicy
+
+API_BASE_URL = "https://api.elevenlabs.io/v1"
+
+
+def read_body(response, chunk_size=64 * 1024) -> bytearray:
+    # reads a streamed (stream=True) response body into one buffer preallocated from Content-Length,
+    # grown only when the length is missing or wrong, instead of collecting chunks and joining them
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        return bytearray(response.content) # compressed body : let requests decode it
+    length = int(response.headers.get("Content-Length") or 0)
+    buffer = bytearray(length or chunk_size)
+    filled = 0
+    while True:
+        if filled == len(buffer):
+            buffer.extend(bytes(max(chunk_size, len(buffer))))
+        with memoryview(buffer)[filled:] as view:
+            read = response.raw.readinto(view)
+        if not read:
+            break
+        filled += read
+    del buffer[filled:]
+    return buffer
+
+
+class ElevenLabsClient:
+    # one place that owns the connections to the ElevenLabs API : a pooled requests.Session for the
+    # synchronous calls (keep-alive + TLS session reuse) and an httpx.AsyncClient for asyncio code.
+    def __init__(
+        self,
+        api_key,
+        base_url=API_BASE_URL,
+        verify=True,
+        pool_size=16,
+        connect_timeout=5.0,
+        read_timeout=60.0,
+        retry_policy=None,
+        limiter=None,
+        ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.verify = verify
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=0)
+        self.limiter = limiter
+        self.metrics = ResilienceMetrics()
+        self._session = None
+        self._async_client = None
+        self._async_loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.verify = self.verify
+                    self._session = session
+        return self._session
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def headers(self, headers=None):
+        merged = {"xi-api-key": self.api_key}
+        if headers:
+            merged.update(headers)
+        return merged
+
+    def _record(self, status_code):
+        # returns True when the response was a throttle (429)
+        self.metrics.add(requests=1)
+        if status_code == 429:
+            self.metrics.add(throttled=1)
+            return True
+        if status_code is not None and status_code >= 500:
+            self.metrics.add(server_errors=1)
+        return False
+
+    def request(self, method, path, headers=None, **kwargs):
+        # retries 429 / 5xx / connection errors with backoff (Retry-After first), every attempt holds
+        # an adaptive concurrency slot; streamed bodies are read after the slot is released
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        headers = self.headers(headers)
+        attempt = 0
+        while True:
+            generation = self.limiter.acquire() if self.limiter is not None else None
+            throttled = False
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.metrics.add(requests=1, connection_errors=1)
+                if self.limiter is not None:
+                    self.limiter.release(succeeded=False, generation=generation)
+                if not self.retry_policy.should_retry(attempt):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+            else:
+                throttled = self._record(response.status_code)
+                if self.limiter is not None:
+                    self.limiter.release(throttled=throttled, succeeded=response.status_code < 500, generation=generation)
+                if not self.retry_policy.should_retry(attempt, response.status_code):
+                    return response
+                delay = self.retry_policy.delay(attempt, response.headers)
+                response.close()
+            self.metrics.add(retries=1, throttle_seconds=delay if throttled else 0.0)
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    @property
+    def async_client(self):
+        # httpx clients are bound to the event loop they were first used on
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            if self._async_client is not None:
+                self._close_async_client(self._async_client, self._async_loop)
+            connect_timeout, read_timeout = self.timeout
+            self._async_client = httpx.AsyncClient(
+                verify=self.verify,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                )
+            self._async_loop = loop
+        return self._async_client
+
+    @staticmethod
+    def _close_async_client(client, loop):
+        # the replaced client's connections belong to its own loop, they are closed there
+        if loop.is_closed():
+            return # nothing can run on it anymore, its sockets are closed when the client is collected
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            threading.Thread(target=loop.run_until_complete, args=(client.aclose(),), daemon=True).start()
+
+    async def _asend(self, method, path, headers=None, stream=False, **kwargs):
+        # async twin of request() : same retries and concurrency slots, the slot is released once the
+        # headers are in, a streamed body is read after that
+        url = self.url(path)
+        headers = self.headers(headers)
+        attempt = 0
+        while True:
+            generation = await self.limiter.acquire_async() if self.limiter is not None else None
+            throttled = False
+            try:
+                request = self.async_client.build_request(method, url, headers=headers, **kwargs)
+                response = await self.async_client.send(request, stream=stream)
+            except httpx.TransportError:
+                self.metrics.add(requests=1, connection_errors=1)
+                if self.limiter is not None:
+                    self.limiter.release(succeeded=False, generation=generation)
+                if not self.retry_policy.should_retry(attempt):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+            else:
+                throttled = self._record(response.status_code)
+                if self.limiter is not None:
+                    self.limiter.release(throttled=throttled, succeeded=response.status_code < 500, generation=generation)
+                if not self.retry_policy.should_retry(attempt, response.status_code):
+                    return response
+                delay = self.retry_policy.delay(attempt, response.headers)
+                await response.aclose()
+            self.metrics.add(retries=1, throttle_seconds=delay if throttled else 0.0)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def arequest(self, method, path, headers=None, **kwargs):
+        return await self._asend(method, path, headers=headers, **kwargs)
+
+    async def aget(self, path, **kwargs):
+        return await self.arequest("GET", path, **kwargs)
+
+    async def apost(self, path, **kwargs):
+        return await self.arequest("POST", path, **kwargs)
+
+    @asynccontextmanager
+    async def astream(self, method, path, headers=None, **kwargs):
+        # use with "async with client.astream(...) as response", the body is read with response.aiter_bytes()
+        response = await self._asend(method, path, headers=headers, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    def resilience_metrics(self):
+        metrics = self.metrics.snapshot()
+        if self.limiter is not None:
+            metrics["concurrency_limit"] = int(self.limiter.limit)
+            metrics["in_flight"] = self.limiter.in_flight
+        return metrics
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_loop = None
@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from tts_metrics import metrics
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, user, cost, remaining, retry_after):
+        super().__init__(f"Budget exceeded for {user} : this request costs {cost:.0f}, {remaining:.0f} left, retry in {retry_after:.0f}s")
+        self.user = user
+        self.cost = cost
+        self.remaining = remaining
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("user", "cost", "priority", "start_tag", "enqueued", "ready")
+
+    def __init__(self, user, cost, priority, start_tag):
+        self.user = user
+        self.cost = cost
+        self.priority = priority
+        self.start_tag = start_tag
+        self.enqueued = time.perf_counter()
+        self.ready = threading.Event()
+
+
+class FairScheduler:
+    # admits at most max_concurrent upstream jobs at a time. Waiting jobs are served by priority class
+    # (interactive before batch), then by start-time fair queueing across users : each job's virtual
+    # finish tag grows with its cost (characters x model token_cost_factor) / the user's weight, so a
+    # 5000 characters document doesn't hold back the short requests of everyone else.
+    # Budgets are token buckets per user (or API key) refilled over budget_window seconds, 0 = unlimited.
+    def __init__(self, max_concurrent=8, default_budget=0, budget_window=3600, budgets=None, weights=None):
+        self.max_concurrent = max_concurrent
+        self.default_budget = default_budget
+        self.budget_window = budget_window
+        self.budgets = dict(budgets or {})
+        self.weights = dict(weights or {})
+        self._queue = []
+        self._sequence = itertools.count()
+        self._finish_tags = {}
+        self._virtual_time = 0.0
+        self._buckets = {}
+        self._running = 0
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.spent = {}
+
+    def _budget(self, user):
+        return self.budgets.get(user, self.default_budget)
+
+    def _charge(self, user, cost):
+        # caller holds the lock
+        budget = self._budget(user)
+        if not budget:
+            return
+        now = time.monotonic()
+        tokens, last = self._buckets.get(user, (budget, now))
+        tokens = min(budget, tokens + (now - last) * budget / self.budget_window)
+        if cost > tokens:
+            self._buckets[user] = (tokens, now)
+            self.rejected += 1
+            retry_after = (cost - tokens) * self.budget_window / budget if cost <= budget else self.budget_window
+            raise BudgetExceeded(user, cost, tokens, retry_after)
+        self._buckets[user] = (tokens - cost, now)
+
+    def _refund(self, user, cost):
+        with self._lock:
+            if user in self._buckets:
+                tokens, last = self._buckets[user]
+                self._buckets[user] = (min(self._budget(user), tokens + cost), last)
+            self.spent[user] = self.spent.get(user, 0) - cost
+
+    def _dispatch(self):
+        # caller holds the lock
+        while self._queue and self._running < self.max_concurrent:
+            _, _, _, ticket = heapq.heappop(self._queue)
+            self._virtual_time = max(self._virtual_time, ticket.start_tag)
+            self._running += 1
+            ticket.ready.set()
+
+    @contextmanager
+    def slot(self, user, cost, priority="interactive"):
+        # blocks until the job is scheduled, raises BudgetExceeded up front when the user can't afford it
+        level = PRIORITIES[priority]
+        with self._lock:
+            self._charge(user, cost)
+            start_tag = max(self._virtual_time, self._finish_tags.get(user, 0.0))
+            finish_tag = start_tag + cost / self.weights.get(user, 1.0)
+            self._finish_tags[user] = finish_tag
+            self.admitted += 1
+            self.spent[user] = self.spent.get(user, 0) + cost
+            ticket = _Ticket(user, cost, priority, start_tag)
+            heapq.heappush(self._queue, (level, finish_tag, next(self._sequence), ticket))
+            self._dispatch()
+        ticket.ready.wait()
+        metrics.observe("tts_queue_wait_seconds", time.perf_counter() - ticket.enqueued, priority=priority)
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._dispatch()
+            if not succeeded:
+                self._refund(user, cost) # failed upstream calls aren't billed
+
+    def run(self, user, cost, priority, function, *args, **kwargs):
+        with self.slot(user, cost, priority):
+            return function(*args, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            depth = {name: 0 for name in PRIORITIES}
+            for _, _, _, ticket in self._queue:
+                depth[ticket.priority] += 1
+            return {
+                "queue_depth": len(self._queue),
+                "queue_depth_interactive": depth["interactive"],
+                "queue_depth_batch": depth["batch"],
+                "running": self._running,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
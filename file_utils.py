@@ -0,0 +1,23 @@
+import os
+import threading
+
+
+def write_atomic(path, data, fsync=True):
+    # write to a temp file next to path then rename it over path : readers never see a half written file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    mode = "w" if isinstance(data, str) else "wb"
+    try:
+        with open(tmp_path, mode) as file:
+            file.write(data)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
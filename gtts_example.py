@@ -1,74 +1,120 @@
 import gradio as gr
-from gtts import gTTS
-from io import BytesIO
 import json
 import os
 from gtts.lang import tts_langs
-import pyttsx3
 import tempfile
 import re
-from datetime import datetime
-import time
+import sys
+import threading
+from pyttsx3_pool import Pyttsx3Pool
+from gtts_parallel import ParallelGTTS
+from tts_cache import SynthesisCache, make_cache_key
+from long_form import split_sentences
+from audio_formats import join_audio
+from tts_router import TTSRouter, gtts_provider, pyttsx3_provider
+from shared_store import SharedStore
+from single_flight import SingleFlight
+import prewarm
+from tts_metrics import metrics, profile_request, record_synthesis, stage_timer, start_metrics_server
 
-engine = pyttsx3.init()
+# every pyttsx3 job runs in a worker process that owns its own engine
+pyttsx3_pool = Pyttsx3Pool(workers=int(os.getenv("pyttsx3_workers", os.cpu_count() or 1)))
 # List of available languages and their corresponding voices
 
-
+pytts_voices = None
 
 def get_pyttsx3_voices():
-    voices = engine.getProperty('voices')
-    return {
-        voice.name :{ voice.id : voice.name} for voice in voices
-    }
+    # enumerated by a worker on first use, the Gradio process never touches an engine
+    global pytts_voices
+    if pytts_voices is None:
+        pytts_voices = pyttsx3_pool.list_voices()
+    return pytts_voices
     
+# gTTS segments are fetched concurrently over a pooled session
+gtts_client = ParallelGTTS(
+    max_workers=int(os.getenv("gtts_workers", 8)),
+    base_url=os.getenv("gtts_base_url"),
+    )
+# sentence level cache shared by both providers : byte-bounded LRU in memory, disk tier below
+segment_cache = SynthesisCache(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_segment_cache"),
+    max_memory_items=4096,
+    max_memory_bytes=int(os.getenv("segment_cache_memory_bytes", 64 * 1024 * 1024)),
+    max_disk_bytes=int(os.getenv("segment_cache_disk_bytes", 512 * 1024 * 1024)),
+    # the workers / replicas of the host share one sentence cache when a shared store is configured
+    store=SharedStore(os.getenv("shared_store_dir")) if os.getenv("shared_store_dir") else None,
+    namespace="segments",
+    )
+in_flight = SingleFlight() # identical requests running at the same time share one synthesis
+metrics.add_collector("segment_cache", segment_cache.stats)
+metrics.add_collector("single_flight", in_flight.stats)
 gtts_voices = json.load(open(os.path.join( os.path.dirname(__file__), 'gtts_voices.json')) )
-pytts_voices = get_pyttsx3_voices()
-
-def google_tts(text, voice='en-us'):
-    # Convert text to speech
-    tts = gTTS(text=text, lang=voice)
-    
-    # Save speech to a BytesIO object
-    with BytesIO() as audio_stream:
-        tts.write_to_fp(audio_stream)
-        audio_stream.seek(0)
-        
-        # Read audio data from BytesIO object
-        audio_data = audio_stream.read()
-        
-        return audio_data
-    
 
-def pyttsx3_tts(text, voice_id, output_dir="./tmp"):
+def google_tts(text, voice='en-us', coalesce=True):
+    # Convert text to speech, the segments are fetched in parallel and joined in order.
+    # coalesce=False always makes its own request (load tests)
+    if not coalesce:
+        return fetch_google_tts(text, voice)
+    return in_flight.do(make_cache_key(provider="gtts", voice=voice, text=text), fetch_google_tts, text, voice)
 
-    # Ensure the output directory exists
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # Initialize pyttsx3 engine inside the function to avoid issues in multi-threaded environments
-    # engine = pyttsx3.init()
-    engine.setProperty('voice', voice_id)
+def fetch_google_tts(text, voice):
+    with stage_timer("gtts", "synthesize"):
+        audio_data = gtts_client.synthesize(text, lang=voice)
+    record_synthesis("gtts", len(text), len(audio_data))
+    return audio_data
     
-    # Generate a unique filename for the audio file within the specified output directory
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    temp_file_path = os.path.join(output_dir, f"audio_{timestamp}.mp3")
 
-    # Save the audio to the temporary file
-    engine.save_to_file(text, temp_file_path)
-    engine.runAndWait()
+def pyttsx3_tts(text, voice_id, output_dir=None):
+    # the job is queued to the worker pool, this thread only waits on the future; the bytes go to Gradio as they are
+    with stage_timer("pyttsx3", "synthesize"): # queue wait + render in the worker
+        audio_data = pyttsx3_pool.synthesize(text, voice_id, output_dir=output_dir)
+    record_synthesis("pyttsx3", len(text), len(audio_data))
+    return audio_data
+
+# 'Auto' provider : gTTS while it is fast and healthy, local pyttsx3 when it isn't, both through the sentence cache.
+# Hedging (a duplicate render on the fallback once gTTS is slow) is opt-in
+router = TTSRouter(
+    providers=[gtts_provider(lambda text, voice, use_cache=True: cached_tts(text, 'gTTS', voice, use_cache=use_cache)[0])],
+    fallback=pyttsx3_provider(lambda text, voice, use_cache=True: cached_tts(text, 'pyttsx3', voice, use_cache=use_cache)[0]),
+    policy=os.getenv("router_policy", "latency"),
+    hedge=os.getenv("router_hedge", "0") == "1",
+    slow_threshold=float(os.getenv("router_slow_threshold", 5)),
+    )
 
-    retries = 5
-    while retries > 0:
-        if os.path.exists(temp_file_path):
-            with open(temp_file_path, 'rb') as audio_file:
-                audio_data = BytesIO(audio_file.read())
-            os.remove(temp_file_path)
-            return audio_data
-        time.sleep(1)  # Wait for 1 second before retrying
-        retries -= 1
+def synthesize_segments(sentences, provider, voice):
+    # renders the cache misses concurrently, one audio part per sentence
+    if provider == 'gTTS':
+        with stage_timer("gtts", "synthesize"):
+            return gtts_client.synthesize_many(sentences, lang=voice)
+    with stage_timer("pyttsx3", "synthesize"):
+        futures = [pyttsx3_pool.submit(sentence, voice) for sentence in sentences]
+        return [future.result() for future in futures]
 
-    # If the file is still not available, raise an exception or handle the error as appropriate
-    raise FileNotFoundError(f"The audio file was not created: {temp_file_path}")
+def cached_tts(text, provider, voice, use_cache=True):
+    # assembles the audio from cached sentences plus freshly synthesized misses, returns (audio, hit ratio)
+    sentences = split_sentences(text)
+    if not sentences:
+        return None, 0.0
+    keys = [make_cache_key(provider=provider, voice=voice, text=sentence) for sentence in sentences]
+    with stage_timer(provider.lower(), "cache_lookup"):
+        parts = [segment_cache.get(key) if use_cache else None for key in keys]
+    misses = {}
+    for index, part in enumerate(parts):
+        if part is None:
+            misses.setdefault(keys[index], []).append(index) # a sentence repeated in the text is synthesized once
+    if misses:
+        first_indexes = [indexes[0] for indexes in misses.values()]
+        for key, audio_data in zip(misses, synthesize_segments([sentences[index] for index in first_indexes], provider, voice)):
+            segment_cache.put(key, audio_data)
+            for index in misses[key]:
+                parts[index] = audio_data
+    hits = len(sentences) - sum(len(indexes) for indexes in misses.values())
+    with stage_timer(provider.lower(), "join"):
+        audio_data = join_audio(parts, "mp3" if provider == 'gTTS' else "wav")
+    record_synthesis(provider.lower(), len(text), len(audio_data))
+    metrics.inc("tts_cache_hits_total", hits, provider=provider.lower())
+    metrics.inc("tts_cache_misses_total", len(sentences) - hits, provider=provider.lower())
+    return audio_data, hits / len(sentences)
 
 with gr.Blocks(
     title="Text-to-Speech with Gradio",
@@ -77,28 +123,29 @@ with gr.Blocks(
         # Create Gradio interface
         with gr.Column(scale=5):
             text_input = gr.Textbox(lines=5, label="Enter your text")
-            tts_provider = gr.Radio(choices=['gTTS', 'pyttsx3'], label="TTS Provider", value='gTTS')
+            tts_provider = gr.Radio(choices=['gTTS', 'pyttsx3', 'Auto'], label="TTS Provider", value='gTTS')
             language_input = gr.Dropdown(choices=list(gtts_voices.keys()), label="Select Language")
             voice_input = gr.Dropdown(choices=[], label="Select Voice", allow_custom_value=True)
             
             def update_voice_choice(provider, language):
-                if provider == 'gTTS':
+                if provider in ('gTTS', 'Auto'):
                     voice_dict = gtts_voices[language]
                     voice_list = [(name, code) for code, name in voice_dict.items()]
                     return gr.Dropdown(choices=voice_list, value=voice_list[0][1])
                 elif provider == 'pyttsx3':
-                    voice_dict = pytts_voices[language]
+                    voice_dict = get_pyttsx3_voices()[language]
                     voice_list = [(name, code) for code, name in voice_dict.items()]
                     return gr.Dropdown(choices=voice_list, value=voice_list[0][1])
                 
             def update_provider_choice(provider):
-                if provider == 'gTTS':
+                if provider in ('gTTS', 'Auto'):
                     default_lang = "English"
                     voice_dict = gtts_voices[default_lang]
                     voice_list = [(name, code) for code, name in voice_dict.items()]
                     return gr.Dropdown(choices=list(gtts_voices.keys()), label="Select Language", value=default_lang) ,gr.Dropdown(choices=voice_list, value=voice_list[0][1])
                 elif provider == 'pyttsx3':
                     # get the first language from the language dictionary
+                    pytts_voices = get_pyttsx3_voices()
                     default_lang = list(pytts_voices.keys())[0]
                     voice_dict = pytts_voices[default_lang]
                     voice_list = [(name, code) for code, name in voice_dict.items()]
@@ -119,20 +166,47 @@ with gr.Blocks(
         with gr.Column(scale=5):
             # Update outputs to match Audio component parameters
             output_audio = gr.Audio(type='numpy', format='mp3')
+            output_audio.postprocess = metrics.timed(output_audio.postprocess, "tts_stage_seconds", provider="gradio", stage="postprocess")
+            cache_status = gr.Textbox(label="Sentence Cache", interactive=False)
+            use_cache_checkbox = gr.Checkbox(label="Use Cache", value=True)
     with gr.Row():
-        def process_tts(text, provider, voice):
-            if provider == 'gTTS':
-                return google_tts(text, voice)
-            elif provider == 'pyttsx3':
-                return pyttsx3_tts(text, voice)
+        def process_tts(text, provider, voice, use_cache):
+            if provider == 'Auto':
+                with profile_request("auto_tts"):
+                    audio_data, served_by = router.synthesize(text, voices={"gtts": voice}, use_cache=use_cache)
+                return audio_data, f"Served by {served_by}"
+            with profile_request(f"{provider}_tts"):
+                # the sentence cache only helps once a request finished : identical ones in flight share the first
+                audio_data, hit_ratio = in_flight.do(
+                    make_cache_key(provider=provider, voice=voice, text=text, use_cache=use_cache),
+                    cached_tts, text, provider, voice, use_cache=use_cache,
+                    )
+            stats = segment_cache.stats()
+            return audio_data, f"This request: {hit_ratio:.0%} of sentences from cache (overall hit rate: {stats['hit_rate']:.0%})"
             
         submit_button = gr.Button("Submit")
         submit_button.click(
                 process_tts,
-                inputs=[text_input,tts_provider, voice_input],
-                outputs=output_audio, 
+                inputs=[text_input,tts_provider, voice_input, use_cache_checkbox],
+                outputs=[output_audio, cache_status], 
             )
+    with gr.Accordion(label="Diagnostics", open=False):
+        diagnostics_display = gr.Textbox(label="Stage timings and counters", lines=12, interactive=False)
+        refresh_diagnostics_btn = gr.Button("Refresh Diagnostics")
+        refresh_diagnostics_btn.click(metrics.summary, outputs=[diagnostics_display])
    
    
 if __name__ == "__main__":
+    if os.getenv("metrics_port"):
+        start_metrics_server(int(os.getenv("metrics_port")))
+    if os.getenv("pyttsx3_warm_up", "0") == "1":
+        # opt-in : starts the pyttsx3 workers and lists their voices while the server comes up
+        threading.Thread(target=get_pyttsx3_voices, name="pyttsx3-warm-up", daemon=True).start()
+    if os.getenv("prewarm_plan"):
+        # known phrases rendered into the sentence cache while the app already serves requests
+        prewarm.start_prewarm_in_background(
+            prewarm.local_entries(sys.modules[__name__], prewarm.load_plan(os.getenv("prewarm_plan"))),
+            workers=int(os.getenv("prewarm_workers", 4)),
+            rate=float(os.getenv("prewarm_rate", 2)),
+            )
     demo.launch()
\ No newline at end of file
@@ -0,0 +1,107 @@
+import base64
+import re
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from gtts import gTTS, gTTSError
+from requests.adapters import HTTPAdapter
+
+from tts_metrics import stage_timer
+
+AUDIO_RE = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+class ParallelGTTS:
+    # gTTS splits the text into ~100 characters parts and fetches them one after the other on a new
+    # session each time; this reuses gTTS's tokenizer / request packaging but fetches the parts
+    # concurrently over a pooled session and writes the mp3 parts back in their original order
+    def __init__(self, max_workers=8, timeout=None, base_url=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.base_url = base_url # e.g. "http://127.0.0.1:8080" to point at a local stand-in
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.max_workers)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="gtts")
+        return self._executor
+
+    def _prepare_requests(self, tts):
+        prepared_requests = tts._prepare_requests()
+        if self.base_url:
+            base = urllib.parse.urlsplit(self.base_url)
+            for prepared in prepared_requests:
+                url = urllib.parse.urlsplit(prepared.url)
+                prepared.url = urllib.parse.urlunsplit(url._replace(scheme=base.scheme, netloc=base.netloc))
+        return prepared_requests
+
+    def _fetch(self, tts, prepared):
+        try:
+            with stage_timer("gtts", "segment_request"):
+                response = self.session.send(prepared, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            raise gTTSError(tts=tts, response=response)
+        except requests.exceptions.RequestException:
+            raise gTTSError(tts=tts)
+        parts = []
+        with stage_timer("gtts", "segment_decode"):
+            for line in response.text.splitlines():
+                if "jQ1olc" not in line:
+                    continue
+                audio_search = AUDIO_RE.search(line)
+                if not audio_search:
+                    # Request successful, good response, no audio stream in response
+                    raise gTTSError(tts=tts, response=response)
+                parts.append(base64.b64decode(audio_search.group(1).encode("ascii")))
+        return b"".join(parts)
+
+    def stream(self, text, lang="en", tld="com", slow=False):
+        # yields the mp3 parts in order, each one as soon as it and every part before it arrived
+        tts = gTTS(text=text, lang=lang, tld=tld, slow=slow)
+        futures = [self.executor.submit(self._fetch, tts, prepared) for prepared in self._prepare_requests(tts)]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def synthesize_many(self, texts, lang="en", tld="com", slow=False) -> list:
+        # every segment of every text goes to the pool at once, results come back per text, in order
+        jobs = []
+        for text in texts:
+            tts = gTTS(text=text, lang=lang, tld=tld, slow=slow)
+            jobs.append([self.executor.submit(self._fetch, tts, prepared) for prepared in self._prepare_requests(tts)])
+        try:
+            return [b"".join(future.result() for future in futures) for futures in jobs]
+        finally:
+            for futures in jobs:
+                for future in futures:
+                    future.cancel()
+
+    def write_to_fp(self, text, fp, lang="en", tld="com", slow=False):
+        for part in self.stream(text, lang=lang, tld=tld, slow=slow):
+            fp.write(part)
+
+    def synthesize(self, text, lang="en", tld="com", slow=False) -> bytes:
+        return b"".join(self.stream(text, lang=lang, tld=tld, slow=slow))
@@ -0,0 +1,74 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+SENTENCE_RE = re.compile(r"(?<=[.!?;。！？])\s+")
+CLAUSE_RE = re.compile(r"(?<=[,:，、])\s+")
+
+
+def _split_long(piece, max_chars):
+    # a sentence that doesn't fit : break it at clause boundaries, then words, then hard cut
+    for pattern in (CLAUSE_RE, re.compile(r"\s+")):
+        parts = [part for part in pattern.split(piece) if part]
+        if len(parts) > 1:
+            return _pack(parts, max_chars, " ")
+    return [piece[i:i + max_chars] for i in range(0, len(piece), max_chars)]
+
+
+def _pack(pieces, max_chars, separator):
+    segments = []
+    current = ""
+    for piece in pieces:
+        if len(piece) > max_chars:
+            if current:
+                segments.append(current)
+                current = ""
+            segments.extend(_split_long(piece, max_chars))
+            continue
+        candidate = f"{current}{separator}{piece}" if current else piece
+        if len(candidate) <= max_chars:
+            current = candidate
+        else:
+            segments.append(current)
+            current = piece
+    if current:
+        segments.append(current)
+    return segments
+
+
+def split_text(text, max_chars):
+    # split text into segments of at most max_chars, cutting at paragraph then sentence boundaries.
+    # Short paragraphs share a segment (kept apart by a blank line) : one request, not one per paragraph
+    pieces = []
+    for paragraph in PARAGRAPH_RE.split(text.strip()):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        pieces.extend(_pack(SENTENCE_RE.split(paragraph), max_chars, " "))
+    return _pack(pieces, max_chars, "\n\n")
+
+
+def split_sentences(text):
+    # every sentence on its own, the unit of the sentence-level caches
+    sentences = []
+    for paragraph in PARAGRAPH_RE.split(text.strip()):
+        paragraph = " ".join(paragraph.split())
+        sentences.extend(sentence for sentence in SENTENCE_RE.split(paragraph) if sentence)
+    return sentences
+
+
+def synthesize_in_order(segments, synthesize, max_workers=4):
+    # renders the segments concurrently (at most max_workers in flight) and yields the results in the
+    # original order, so the first segment can be played while the next ones are still rendering
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="long-form")
+    futures = [executor.submit(synthesize, segment) for segment in segments]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# local stand-ins for the ElevenLabs API and the gTTS translate endpoint, with configurable latency
+# (time to first byte) and throughput (bytes/s of audio), so the TTS paths can be measured offline
+
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413 # one silent mpeg 1 layer III frame, 128 kbps, 44.1 kHz
+AUDIO_BYTES_PER_CHAR = 1000 # ~128 kbps mp3 at ~15 characters of speech per second
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "11labs")
+
+
+def fake_mp3(text):
+    frames = max(1, len(text) * AUDIO_BYTES_PER_CHAR // len(MP3_FRAME))
+    return MP3_FRAME * frames
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.1
+    throughput = 0 # bytes/s, 0 for unlimited
+    chunk_size = 4096
+    statuses = None # cycled over the text-to-speech requests, e.g. [429, 200, 200] : injected throttles / outages
+    retry_after = 1 # Retry-After header of the injected 429 / 503
+    _request_count = None
+
+    def _injected_status(self):
+        if not self.statuses:
+            return 200
+        return self.statuses[next(self._request_count) % len(self.statuses)]
+
+    def _send_injected(self, status):
+        body = json.dumps({"detail": {"status": "too_many_concurrent_requests" if status == 429 else "service_unavailable"}}).encode()
+        time.sleep(self.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status in (429, 503) and self.retry_after is not None:
+            self.send_header("Retry-After", f"{self.retry_after:g}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, body, content_type="application/json", status=200):
+        time.sleep(self.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self._write_paced(body)
+
+    def _write_paced(self, body, chunked=False):
+        view = memoryview(body)
+        for offset in range(0, len(body), self.chunk_size):
+            chunk = view[offset:offset + self.chunk_size]
+            if chunked:
+                self.wfile.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+            else:
+                self.wfile.write(chunk)
+            self.wfile.flush()
+            if self.throughput:
+                time.sleep(len(chunk) / self.throughput)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _send_file(self, name):
+        with open(os.path.join(DATA_DIR, name), "rb") as file:
+            self._send(file.read())
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/v1/voices":
+            return self._send_file("voices.json")
+        if path == "/v1/models":
+            return self._send_file("models.json")
+        if re.fullmatch(r"/v1/voices/[^/]+/settings", path):
+            return self._send(json.dumps({"stability": 0.5, "similarity_boost": 0.75, "style": 0.0, "use_speaker_boost": True}).encode())
+        self._send(b'{"detail": "not found"}', status=404)
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        body = self._read_body()
+        if path.startswith("/v1/text-to-speech/"):
+            status = self._injected_status()
+            if status != 200:
+                return self._send_injected(status)
+        if re.fullmatch(r"/v1/text-to-speech/[^/]+/stream", path):
+            audio = fake_mp3(json.loads(body or b"{}").get("text", ""))
+            time.sleep(self.latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            return self._write_paced(audio, chunked=True)
+        if re.fullmatch(r"/v1/text-to-speech/[^/]+", path):
+            return self._send(fake_mp3(json.loads(body or b"{}").get("text", "")), content_type="audio/mpeg")
+        if path.endswith("/batchexecute"):
+            # gTTS : f.req=[[["jQ1olc","[\"text\",\"lang\",...]",null,"generic"]]]
+            rpc = json.loads(urllib.parse.unquote(body.decode()[len("f.req="):].rstrip("&")))
+            text = json.loads(rpc[0][0][1])[0]
+            audio = base64.b64encode(fake_mp3(text)).decode()
+            response = ")]}'\n\n100\n" + '[["wrb.fr","jQ1olc","[\\"%s\\"]",null,null,null,"generic"]]\n' % audio
+            return self._send(response.encode(), content_type="application/json")
+        self._send(b'{"detail": "not found"}', status=404)
+
+
+async def stream_input_handler(websocket, latency=0.1):
+    # stand-in for /v1/text-to-speech/{voice_id}/stream-input : buffers the text it receives and answers
+    # with audio once the first chunk_length_schedule step is reached, on flush and at the end of input
+    path = websocket.path if hasattr(websocket, "path") else websocket.request.path # websockets < 14 / >= 14
+    if not re.match(r"^/v1/text-to-speech/[^/]+/stream-input", path):
+        return await websocket.close(1008, "not found")
+    first = json.loads(await websocket.recv())
+    schedule = (first.get("generation_config") or {}).get("chunk_length_schedule") or [120]
+    pending = ""
+    async def send_audio(text):
+        await asyncio.sleep(latency)
+        await websocket.send(json.dumps({"audio": base64.b64encode(fake_mp3(text)).decode(), "isFinal": None}))
+    async for message in websocket:
+        data = json.loads(message)
+        if data.get("text") == "":
+            if pending.strip():
+                await send_audio(pending)
+            await websocket.send(json.dumps({"isFinal": True}))
+            return
+        pending += data.get("text", "")
+        if data.get("flush") or len(pending) >= schedule[0]:
+            await send_audio(pending)
+            pending = ""
+
+
+def start_mock_websocket_server(host="127.0.0.1", port=0, latency=0.1):
+    # runs in its own event loop thread, returns the bound port : base url f"http://{host}:{port}/v1"
+    import websockets
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    bound = {}
+    async def serve():
+        server = await websockets.serve(lambda websocket, *args: stream_input_handler(websocket, latency), host, port)
+        bound["port"] = next(iter(server.sockets)).getsockname()[1]
+        started.set()
+        await asyncio.Future()
+    threading.Thread(target=loop.run_until_complete, args=(serve(),), name="mock-tts-websocket", daemon=True).start()
+    started.wait()
+    return bound["port"]
+
+
+def start_mock_server(host="127.0.0.1", port=0, latency=0.1, throughput=0, statuses=None, retry_after=1):
+    # returns the running server, its base url is f"http://{host}:{server.server_port}"
+    handler = type("ConfiguredMockHandler", (MockHandler,), {
+        "latency": latency,
+        "throughput": throughput,
+        "statuses": list(statuses) if statuses else None,
+        "retry_after": retry_after,
+        "_request_count": itertools.count(), # next() on a count is atomic under the GIL
+        })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-tts-server", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Local stand-in for the ElevenLabs and gTTS endpoints")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds before the first byte")
+    parser.add_argument("--throughput", type=int, default=0, help="audio bytes per second, 0 for unlimited")
+    parser.add_argument("--statuses", default="", help="comma separated statuses cycled over the TTS requests, e.g. 429,200,200 or 503,200")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After of the injected 429 / 503")
+    args = parser.parse_args()
+    server = start_mock_server(
+        port=args.port,
+        latency=args.latency,
+        throughput=args.throughput,
+        statuses=[int(status) for status in args.statuses.split(",") if status],
+        retry_after=args.retry_after,
+        )
+    print(f"Mock server listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
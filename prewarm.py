@@ -0,0 +1,159 @@
+import argparse
+import importlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_synthesis import DEFAULT_SETTINGS
+from long_form import split_sentences
+from tts_cache import make_cache_key
+
+# renders a known phrase list (IVR prompts, greetings...) for a matrix of voices / models / formats into
+# the caches the request handlers read first, so that the first caller of a known phrase never waits on
+# synthesis. Plan file :
+# {
+#     "phrases": ["Welcome to ...", "Please hold ..."],    (or "phrases_file": "phrases.txt", one per line)
+#     "elevenlabs": {"voices": ["..."], "models": ["eleven_multilingual_v2"], "formats": ["mp3_44100_128", "ulaw_8000"],
+#                    "settings": {...}, "optimize_streaming_latency": 0},
+#     "gtts": {"voices": ["en", "fr"]},
+#     "pyttsx3": {"voices": ["..."]}
+# }
+# usage : python prewarm.py plan.json --workers 4 --rate 2
+
+
+def load_plan(path):
+    with open(path, "r", encoding="utf-8") as file:
+        plan = json.load(file)
+    phrases = list(plan.get("phrases") or [])
+    if plan.get("phrases_file"):
+        with open(plan["phrases_file"], "r", encoding="utf-8") as file:
+            phrases += [line.strip() for line in file if line.strip()]
+    plan["phrases"] = list(dict.fromkeys(phrases)) # deduplicated, in order
+    return plan
+
+
+class RateLimiter:
+    # evenly spaced starts, at most `rate` per second (0 = unlimited), shared by the worker threads
+    def __init__(self, rate=0):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+def elevenlabs_entries(elevenlabs, plan):
+    config = plan.get("elevenlabs") or {}
+    settings = config.get("settings") or DEFAULT_SETTINGS
+    entries = []
+    for text in plan["phrases"]:
+        for voice_id in config.get("voices") or []:
+            for model_id in config.get("models") or []:
+                for output_format in config.get("formats") or ["mp3_44100_128"]:
+                    request = {
+                        "text": text,
+                        "model_id": model_id,
+                        "voice_id": voice_id,
+                        "voice_settings": settings,
+                        "output_format": output_format,
+                        }
+                    entries.append({
+                        "provider": "elevenlabs",
+                        "is_cached": lambda request=request: elevenlabs.tts_cache.contains(make_cache_key(**request)),
+                        "render": lambda request=request: elevenlabs.synthesize_audio(
+                            **request,
+                            optimize_streaming_latency=config.get("optimize_streaming_latency", 0),
+                            use_cache=True,
+                            user="prewarm",
+                            priority="batch"
+                            ),
+                        })
+    return entries
+
+
+def local_entries(gtts_example, plan):
+    # the gTTS / pyttsx3 handlers assemble their audio from the sentence cache : warm it sentence by sentence
+    entries = []
+    for provider, name in (("gTTS", "gtts"), ("pyttsx3", "pyttsx3")):
+        config = plan.get(name) or {}
+        for text in plan["phrases"]:
+            for voice in config.get("voices") or []:
+                keys = [make_cache_key(provider=provider, voice=voice, text=sentence) for sentence in split_sentences(text)]
+                entries.append({
+                    "provider": name,
+                    "is_cached": lambda keys=keys: all(gtts_example.segment_cache.contains(key) for key in keys),
+                    "render": lambda text=text, provider=provider, voice=voice: gtts_example.cached_tts(text, provider, voice),
+                    })
+    return entries
+
+
+def prewarm(entries, workers=4, rate=0):
+    # renders the entries that aren't cached yet, returns the coverage per provider
+    report = {}
+    for entry in entries:
+        counts = report.setdefault(entry["provider"], {"total": 0, "cached": 0, "rendered": 0, "failed": 0})
+        counts["total"] += 1
+    missing = []
+    for entry in entries:
+        if entry["is_cached"]():
+            report[entry["provider"]]["cached"] += 1
+        else:
+            missing.append(entry)
+    limiter = RateLimiter(rate)
+    lock = threading.Lock()
+    def render(entry):
+        limiter.wait()
+        try:
+            entry["render"]()
+            outcome = "rendered"
+        except Exception as e:
+            print(f"Warning : pre-warm of a {entry['provider']} entry failed : {e}")
+            outcome = "failed"
+        with lock:
+            report[entry["provider"]][outcome] += 1
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prewarm") as executor:
+        list(executor.map(render, missing))
+    for counts in report.values():
+        counts["coverage"] = (counts["cached"] + counts["rendered"]) / counts["total"] if counts["total"] else 1.0
+    print(f"Pre-warm done in {time.perf_counter() - start:.1f}s : " + ", ".join(
+        f"{provider} {counts['coverage']:.0%} of {counts['total']}" for provider, counts in report.items()
+        ))
+    return report
+
+
+def start_prewarm_in_background(entries, workers=4, rate=0):
+    # startup hook : the app serves requests meanwhile, a known phrase is a cache hit once its entry is rendered
+    thread = threading.Thread(target=prewarm, args=(entries, workers, rate), name="prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a phrase list into the synthesis caches ahead of traffic")
+    parser.add_argument("plan", help="JSON plan : phrases plus the voice / model / format matrix per provider")
+    parser.add_argument("--providers", default="elevenlabs,gtts,pyttsx3")
+    parser.add_argument("--workers", type=int, default=4, help="entries rendered concurrently")
+    parser.add_argument("--rate", type=float, default=0, help="maximum renders started per second, 0 for unlimited")
+    args = parser.parse_args()
+    plan = load_plan(args.plan)
+    providers = args.providers.split(",")
+    entries = []
+    if "elevenlabs" in providers and plan.get("elevenlabs"):
+        entries += elevenlabs_entries(importlib.import_module("11labs_example"), plan)
+    if any(plan.get(name) and name in providers for name in ("gtts", "pyttsx3")):
+        entries += [entry for entry in local_entries(importlib.import_module("gtts_example"), plan) if entry["provider"] in providers]
+    report = prewarm(entries, workers=args.workers, rate=args.rate)
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+# pyttsx3 engines aren't thread-safe and runAndWait() blocks, so every worker process owns its engine
+# and the Gradio threads only submit jobs and wait on futures
+
+_engine = None
+_engine_voice_id = None
+_finished_utterances = {}
+
+
+def default_spool_dir():
+    # RAM backed when the host has one, so the engine's output never touches the disk
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def _on_finished_utterance(name, completed):
+    _finished_utterances[name] = completed
+
+
+def _get_engine(voice_id=None):
+    # pyttsx3.init() hands out one engine per driver and process : keep it and only switch voices when needed
+    global _engine, _engine_voice_id
+    if _engine is None:
+        import pyttsx3
+        _engine = pyttsx3.init()
+        _engine.connect('finished-utterance', _on_finished_utterance)
+    if voice_id and voice_id != _engine_voice_id:
+        _engine.setProperty('voice', voice_id)
+        _engine_voice_id = voice_id
+    return _engine
+
+
+def _init_worker():
+    # warm the engine up front; a failure here would break the whole pool, so let the first job raise instead
+    try:
+        _get_engine()
+    except Exception as e:
+        print(f"Warning : pyttsx3 engine couldn't be initialized : {e}")
+
+
+def _list_voices():
+    voices = _get_engine().getProperty('voices')
+    return {
+        voice.name :{ voice.id : voice.name} for voice in voices
+    }
+
+
+def _synthesize(text, voice_id, output_dir):
+    engine = _get_engine(voice_id)
+    os.makedirs(output_dir, exist_ok=True)
+    # unique per process and job, so concurrent jobs never share a file
+    job_name = f"tts_{os.getpid()}_{uuid.uuid4().hex}"
+    temp_file_path = os.path.join(output_dir, f"{job_name}.wav")
+
+    # runAndWait() returns once the engine reported the utterance as finished, no polling needed
+    engine.save_to_file(text, temp_file_path, job_name)
+    engine.runAndWait()
+    completed = _finished_utterances.pop(job_name, None)
+    try:
+        if completed is False or not os.path.exists(temp_file_path):
+            raise FileNotFoundError(f"The audio file was not created: {temp_file_path}")
+        with open(temp_file_path, 'rb') as audio_file:
+            return audio_file.read()
+    finally:
+        try:
+            os.remove(temp_file_path)
+        except OSError:
+            pass
+
+
+class Pyttsx3Pool:
+    # pool of worker processes, each with its own pyttsx3 engine; created on first use
+    def __init__(self, workers=None, output_dir=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.output_dir = output_dir or default_spool_dir()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        return self._executor
+
+    def submit(self, text, voice_id, output_dir=None):
+        return self.executor.submit(_synthesize, text, voice_id, output_dir or self.output_dir)
+
+    def synthesize(self, text, voice_id, output_dir=None, timeout=None) -> bytes:
+        return self.submit(text, voice_id, output_dir).result(timeout=timeout)
+
+    async def asynthesize(self, text, voice_id, output_dir=None) -> bytes:
+        return await asyncio.wrap_future(self.submit(text, voice_id, output_dir))
+
+    def list_voices(self, timeout=None) -> dict:
+        return self.executor.submit(_list_voices).result(timeout=timeout)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
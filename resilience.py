@@ -0,0 +1,145 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def retry_after_seconds(headers):
+    # Retry-After is either a number of seconds or an HTTP date
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    # exponential backoff with full jitter, Retry-After wins when the server sends it
+    def __init__(self, max_retries=4, base_delay=0.5, max_delay=20.0, retry_statuses=RETRY_STATUSES):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+
+    def should_retry(self, attempt, status_code=None):
+        if attempt >= self.max_retries:
+            return False
+        return status_code is None or status_code in self.retry_statuses
+
+    def delay(self, attempt, headers=None):
+        retry_after = retry_after_seconds(headers)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class AdaptiveConcurrencyLimiter:
+    # AIMD : the limit grows by ~1 per "window" of successes and is cut multiplicatively on a 429.
+    # acquire() hands out the current cut generation : a 429 of a request started before the last cut
+    # was sent at the old rate and is already accounted for, so a burst of them cuts the limit once.
+    # On top of that the limit is cut at most once per cut_interval seconds
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=64, backoff_factor=0.5, cut_interval=1.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_factor = backoff_factor
+        self.cut_interval = cut_interval
+        self._last_cut = float("-inf")
+        self.limit = float(initial_limit)
+        self.in_flight = 0
+        self.throttles = 0
+        self.cuts = 0
+        self._condition = threading.Condition()
+        self._async_waiters = [] # (loop, future) of the coroutines waiting in acquire_async
+
+    def _has_room(self):
+        return self.in_flight < max(self.min_limit, int(self.limit))
+
+    def acquire(self):
+        # returns the generation to pass back to release()
+        with self._condition:
+            while not self._has_room():
+                self._condition.wait()
+            self.in_flight += 1
+            return self.cuts
+
+    def try_acquire(self):
+        # the generation, None when there is no room
+        with self._condition:
+            if not self._has_room():
+                return None
+            self.in_flight += 1
+            return self.cuts
+
+    async def acquire_async(self):
+        # waits on a future that release() resolves, without blocking the event loop nor polling
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._has_room():
+                    self.in_flight += 1
+                    return self.cuts
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            await waiter
+
+    @staticmethod
+    def _wake(waiter):
+        if not waiter.done(): # cancelled waiters are skipped
+            waiter.set_result(None)
+
+    def release(self, throttled=False, succeeded=True, generation=None):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                now = time.monotonic()
+                if (generation is None or generation >= self.cuts) and now - self._last_cut >= self.cut_interval:
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff_factor)
+                    self.cuts += 1
+                    self._last_cut = now
+            elif succeeded:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        # release() may run on another thread (or loop) than the waiters : woken through their own loop
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(self._wake, waiter)
+            except RuntimeError: # that loop is closed
+                pass
+
+
+class ResilienceMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.server_errors = 0
+        self.connection_errors = 0
+        self.throttle_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "server_errors": self.server_errors,
+                "connection_errors": self.connection_errors,
+                "throttle_seconds": self.throttle_seconds,
+            }
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from file_utils import write_atomic
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+
+class SharedStore:
+    # on-host store shared by every worker / replica of the apps : one SQLite database in WAL mode
+    # (concurrent readers, writers serialized by SQLite's lock) indexes the documents (catalogs, voice
+    # settings) and the audio entries, the audio itself lives in content-addressed blob files
+    # (blobs/ab/<sha256>) so identical audio under several keys is stored once.
+    # A blob file is written or unlinked only inside a write transaction, so eviction by one process
+    # can't remove the audio another one is registering; a reader losing that race just gets a miss.
+    def __init__(self, directory, busy_timeout=30.0, touch_interval=60.0):
+        self.directory = directory
+        self.busy_timeout = busy_timeout
+        self.touch_interval = touch_interval # access times are refreshed at most this often, reads stay read-only
+        self.db_path = os.path.join(directory, "store.sqlite3")
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.lock_dir = os.path.join(directory, "locks")
+        self._local = threading.local()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.lock_dir, exist_ok=True)
+        with self.transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS documents (namespace TEXT, key TEXT, value TEXT, updated REAL, PRIMARY KEY (namespace, key))")
+            db.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER)")
+            db.execute("CREATE TABLE IF NOT EXISTS entries (namespace TEXT, key TEXT, digest TEXT, accessed REAL, PRIMARY KEY (namespace, key))")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (namespace, accessed)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)")
+            # running byte total of each namespace's entries, kept in the same transactions as the entries
+            db.execute("CREATE TABLE IF NOT EXISTS usage (namespace TEXT PRIMARY KEY, bytes INTEGER)")
+
+    def _connection(self):
+        # one connection per thread, sqlite3 connections aren't shared across threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front : writers queue on busy_timeout instead of failing on upgrade
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    @contextmanager
+    def lock(self, name):
+        # cross-process mutex (advisory file lock), e.g. one catalog refresh on the host at a time
+        with open(os.path.join(self.lock_dir, f"{name}.lock"), "a+") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError: # LK_LOCK gives up after 10 seconds
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+                else:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # documents : small JSON values, catalogs and voice settings
+
+    def get_document(self, namespace, key):
+        # (value, updated timestamp), None when missing
+        row = self._connection().execute("SELECT value, updated FROM documents WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def documents(self, namespace) -> dict:
+        rows = self._connection().execute("SELECT key, value FROM documents WHERE namespace = ?", (namespace,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def put_documents(self, namespace, items):
+        now = time.time()
+        rows = [(namespace, key, json.dumps(value, separators=(",", ":"), sort_keys=True), now) for key, value in items.items()]
+        with self.transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO documents (namespace, key, value, updated) VALUES (?, ?, ?, ?)", rows)
+
+    def put_document(self, namespace, key, value):
+        self.put_documents(namespace, {key: value})
+
+    # audio : entries (namespace, key) -> content-addressed blob
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _entry(self, namespace, key, max_age):
+        row = self._connection().execute("SELECT digest, accessed FROM entries WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        if row is None or (max_age and time.time() - row[1] > max_age):
+            return None
+        return row
+
+    def has_blob(self, namespace, key, max_age=0):
+        row = self._entry(namespace, key, max_age)
+        return row is not None and os.path.exists(self._blob_path(row[0]))
+
+    def get_blob(self, namespace, key, max_age=0):
+        row = self._entry(namespace, key, max_age)
+        if row is None:
+            return None
+        digest, accessed = row
+        try:
+            with open(self._blob_path(digest), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            # evicted (or removed by hand) after the lookup
+            with self.transaction() as db:
+                self._usage(db, namespace)
+                size = self._entry_size(db, namespace, key, digest)
+                if db.execute("DELETE FROM entries WHERE namespace = ? AND key = ? AND digest = ?", (namespace, key, digest)).rowcount:
+                    self._add_usage(db, namespace, -size)
+            return None
+        now = time.time()
+        if now - accessed > self.touch_interval:
+            self._connection().execute("UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+        return data
+
+    def put_blob(self, namespace, key, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        with self.transaction() as db:
+            self._usage(db, namespace)
+            previous = self._entry_size(db, namespace, key)
+            known = db.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if known is None or not os.path.exists(path):
+                write_atomic(path, data, fsync=False)
+                db.execute("INSERT OR REPLACE INTO blobs (digest, size) VALUES (?, ?)", (digest, len(data)))
+            db.execute("INSERT OR REPLACE INTO entries (namespace, key, digest, accessed) VALUES (?, ?, ?, ?)", (namespace, key, digest, time.time()))
+            self._add_usage(db, namespace, len(data) - previous)
+
+    def _entry_size(self, db, namespace, key, digest=None):
+        row = db.execute(
+            "SELECT blobs.size FROM entries JOIN blobs ON entries.digest = blobs.digest WHERE entries.namespace = ? AND entries.key = ?"
+            + (" AND entries.digest = ?" if digest else ""),
+            (namespace, key, digest) if digest else (namespace, key),
+            ).fetchone()
+        return row[0] if row else 0
+
+    def _usage(self, db, namespace):
+        # bytes of the namespace (a blob shared by several of its keys counts once per key), read from the
+        # running total : summed over the entries only the first time, e.g. on a store created before the total
+        row = db.execute("SELECT bytes FROM usage WHERE namespace = ?", (namespace,)).fetchone()
+        if row is not None:
+            return row[0]
+        total, = db.execute(
+            "SELECT COALESCE(SUM(blobs.size), 0) FROM entries JOIN blobs ON entries.digest = blobs.digest WHERE entries.namespace = ?",
+            (namespace,),
+            ).fetchone()
+        db.execute("INSERT OR REPLACE INTO usage (namespace, bytes) VALUES (?, ?)", (namespace, total))
+        return total
+
+    def _add_usage(self, db, namespace, delta):
+        # caller holds the write transaction and called _usage() first, so the row exists
+        if delta:
+            db.execute("UPDATE usage SET bytes = bytes + ? WHERE namespace = ?", (delta, namespace))
+
+    def evict(self, namespace, max_bytes=0, max_age=0) -> int:
+        # drops the namespace's expired entries, then its least recently used ones until it fits max_bytes,
+        # then the blobs no entry references anymore. Returns the number of entries removed.
+        # Under budget it costs two index lookups (running total, oldest access), cheap enough for every put
+        now = time.time()
+        db = self._connection()
+        oldest, = db.execute("SELECT MIN(accessed) FROM entries WHERE namespace = ?", (namespace,)).fetchone()
+        if (not max_bytes or self._usage(db, namespace) <= max_bytes) and (not max_age or oldest is None or now - oldest <= max_age):
+            return 0 # nothing to do : no write lock taken
+        victims = []
+        with self.transaction() as db:
+            total = self._usage(db, namespace)
+            rows = db.execute(
+                "SELECT entries.key, entries.digest, entries.accessed, blobs.size FROM entries JOIN blobs ON entries.digest = blobs.digest WHERE entries.namespace = ? ORDER BY entries.accessed",
+                (namespace,),
+                )
+            # once over budget, down to 90 % of it : the next puts don't each pay a write transaction to free one entry
+            target = max_bytes * 0.9 if max_bytes and total > max_bytes else max_bytes
+            for key, digest, accessed, size in rows:
+                expired = max_age and accessed < now - max_age
+                if not expired and (not target or total <= target):
+                    break
+                victims.append((key, digest))
+                total -= size
+            db.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", [(namespace, key) for key, _ in victims])
+            db.execute("UPDATE usage SET bytes = ? WHERE namespace = ?", (total, namespace))
+            self._collect_blobs(db, {digest for _, digest in victims})
+        return len(victims)
+
+    def _collect_blobs(self, db, digests=None):
+        # caller holds the write transaction. digests : the candidates (whose entries were just removed), all blobs if None
+        if digests is None:
+            orphans = [digest for digest, in db.execute("SELECT digest FROM blobs WHERE digest NOT IN (SELECT digest FROM entries)")]
+        else:
+            orphans = [digest for digest in digests if db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None]
+        db.executemany("DELETE FROM blobs WHERE digest = ?", [(digest,) for digest in orphans])
+        for digest in orphans:
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+
+    def clear_blobs(self, namespace) -> int:
+        with self.transaction() as db:
+            removed = db.execute("DELETE FROM entries WHERE namespace = ?", (namespace,)).rowcount
+            db.execute("INSERT OR REPLACE INTO usage (namespace, bytes) VALUES (?, 0)", (namespace,))
+            self._collect_blobs(db)
+        return removed
+
+    def stats(self, namespace):
+        db = self._connection()
+        total = self._usage(db, namespace)
+        entries, = db.execute("SELECT COUNT(*) FROM entries WHERE namespace = ?", (namespace,)).fetchone()
+        return {"entries": entries, "bytes": total}
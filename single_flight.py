@@ -0,0 +1,120 @@
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Stream:
+    # items produced once by the pump thread, replayed to every subscriber from the start
+    def __init__(self):
+        self.items = []
+        self.finished = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def publish(self, item):
+        with self.condition:
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.finished = True
+            self.error = error
+            self.condition.notify_all()
+
+    def subscribe(self):
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.items) and not self.finished:
+                    self.condition.wait()
+                items = self.items[index:]
+                finished = self.finished
+                error = self.error
+            for item in items:
+                yield item
+            index += len(items)
+            if finished and index >= len(self.items):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    # concurrent calls with the same key share one execution : the first caller (leader) runs it, the
+    # ones arriving while it is in flight wait for its result, or its exception. The key is forgotten
+    # as soon as the call completes, this is not a cache.
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.collapsed = 0
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.collapsed += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stream(self, key, make_iterator):
+        # fan-out : one pump thread drains make_iterator() and every concurrent subscriber gets all of
+        # its items, a late joiner first gets the ones already sent. A subscriber that stops early (closed
+        # Gradio tab) doesn't stop the pump, the others and the cache still get the whole stream.
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = self._streams[key] = _Stream()
+                self.leaders += 1
+                threading.Thread(target=self._pump, args=(key, shared, make_iterator), name="single-flight-stream", daemon=True).start()
+            else:
+                self.collapsed += 1
+        return shared.subscribe()
+
+    def _pump(self, key, shared, make_iterator):
+        error = None
+        try:
+            for item in make_iterator():
+                shared.publish(item)
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                del self._streams[key]
+            shared.finish(error)
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.collapsed
+            return {
+                "leaders": self.leaders,
+                "collapsed": self.collapsed,
+                "collapse_rate": self.collapsed / calls if calls else 0.0,
+                "in_flight": len(self._calls) + len(self._streams),
+            }
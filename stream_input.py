@@ -0,0 +1,168 @@
+import asyncio
+import base64
+import json
+import re
+import ssl
+import time
+import urllib.parse
+
+import websockets
+
+from long_form import split_sentences
+from tts_metrics import metrics, record_synthesis
+
+# ElevenLabs "stream-input" WebSocket protocol : the text goes up in fragments while the audio comes back,
+# so synthesis starts with the first sentence of an LLM answer instead of after the last token.
+# -> {"text": " ", "voice_settings": {...}, "generation_config": {"chunk_length_schedule": [...]}, "xi_api_key": "..."}
+# -> {"text": "Hello there. "}   (optionally "flush": true to render what the server buffered right away)
+# -> {"text": ""}                 end of input
+# <- {"audio": "<base64>", "isFinal": null, ...} ... {"isFinal": true}
+
+DEFAULT_CHUNK_LENGTH_SCHEDULE = [120, 160, 250, 290]
+SENTENCE_END_RE = re.compile(r"[.!?;。！？][\"')\]]*\s")
+CLAUSE_END_RE = re.compile(r"[,:，、]\s")
+
+
+class FragmentBuffer:
+    # collects the text fragments (LLM tokens) and releases text at sentence ends once min_chars are
+    # buffered; past max_chars it cuts at the last clause boundary, then the last space, never mid-word
+    def __init__(self, min_chars=20, max_chars=250):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._text = ""
+
+    def _cut(self):
+        for match in SENTENCE_END_RE.finditer(self._text):
+            if match.end() >= self.min_chars:
+                return match.end()
+        if len(self._text) <= self.max_chars:
+            return None
+        window = self._text[:self.max_chars]
+        clauses = list(CLAUSE_END_RE.finditer(window))
+        if clauses:
+            return clauses[-1].end()
+        space = window.rfind(" ")
+        return space + 1 if space > 0 else self.max_chars
+
+    def feed(self, fragment) -> list:
+        self._text += fragment
+        ready = []
+        while True:
+            cut = self._cut()
+            if cut is None:
+                return ready
+            text = self._text[:cut].strip()
+            self._text = self._text[cut:].lstrip()
+            if text:
+                ready.append(f"{text} ") # the API expects every chunk to end with a space
+
+    def flush(self):
+        text = self._text.strip()
+        self._text = ""
+        return f"{text} " if text else ""
+
+
+def websocket_url(base_url, voice_id, model_id, output_format):
+    # https://api.elevenlabs.io/v1 -> wss://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream-input?...
+    url = urllib.parse.urlsplit(base_url)
+    scheme = {"https": "wss", "http": "ws"}.get(url.scheme, url.scheme)
+    query = urllib.parse.urlencode({"model_id": model_id, "output_format": output_format})
+    return urllib.parse.urlunsplit((scheme, url.netloc, f"{url.path.rstrip('/')}/text-to-speech/{voice_id}/stream-input", query, ""))
+
+
+def ssl_context(verify):
+    # same meaning as requests' verify : True, False or a CA bundle path
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+    if isinstance(verify, str):
+        return ssl.create_default_context(cafile=verify)
+    return ssl.create_default_context()
+
+
+async def synthesize_stream_input(
+    client,
+    fragments,
+    voice_id,
+    model_id,
+    voice_settings=None,
+    output_format="mp3_44100_128",
+    chunk_length_schedule=None,
+    flush_sentences=False,
+    min_chars=20,
+    max_chars=250,
+    ):
+    # fragments : async iterator of text pieces. Yields audio chunks (bytes) as the server sends them.
+    # chunk_length_schedule : characters the server buffers before each generation (first, second...);
+    # flush_sentences : force a generation after every released sentence, lowest latency, choppier prosody
+    url = websocket_url(client.base_url, voice_id, model_id, output_format)
+    options = {"max_size": None}
+    if url.startswith("wss://"):
+        options["ssl"] = ssl_context(client.verify)
+    start = time.perf_counter()
+    characters = 0
+    audio_bytes = 0
+    first_audio = None
+    async with websockets.connect(url, **options) as websocket:
+        metrics.observe("tts_stage_seconds", time.perf_counter() - start, provider="elevenlabs_ws", stage="connect")
+        await websocket.send(json.dumps({
+            "text": " ",
+            "voice_settings": voice_settings,
+            "generation_config": {"chunk_length_schedule": chunk_length_schedule or DEFAULT_CHUNK_LENGTH_SCHEDULE},
+            "xi_api_key": client.api_key,
+            }))
+
+        async def send_fragments():
+            nonlocal characters
+            buffer = FragmentBuffer(min_chars=min_chars, max_chars=max_chars)
+            try:
+                async for fragment in fragments:
+                    for text in buffer.feed(fragment):
+                        characters += len(text)
+                        message = {"text": text}
+                        if flush_sentences:
+                            message["flush"] = True
+                        await websocket.send(json.dumps(message))
+                text = buffer.flush()
+                if text:
+                    characters += len(text)
+                    await websocket.send(json.dumps({"text": text, "flush": True}))
+                await websocket.send(json.dumps({"text": ""})) # end of input, the server renders the rest and closes
+            except Exception:
+                await websocket.close() # the fragment source failed : stop the receiving side too
+                raise
+
+        sender = asyncio.create_task(send_fragments())
+        try:
+            async for message in websocket:
+                data = json.loads(message)
+                if data.get("audio"):
+                    chunk = base64.b64decode(data["audio"])
+                    if first_audio is None:
+                        first_audio = time.perf_counter() - start
+                        metrics.observe("tts_stage_seconds", first_audio, provider="elevenlabs_ws", stage="first_audio")
+                    audio_bytes += len(chunk)
+                    yield chunk
+                if data.get("isFinal"):
+                    break
+                if data.get("error"):
+                    raise RuntimeError(f"stream-input error : {data.get('message') or data['error']}")
+        except BaseException: # the receiving side failed, or the consumer stopped iterating
+            sender.cancel()
+            raise
+        # a failing fragment source closes the socket, which ends the loop above before the sender task
+        # is done : awaiting it raises the source's error instead of returning a truncated stream
+        await sender
+    metrics.observe("tts_stage_seconds", time.perf_counter() - start, provider="elevenlabs_ws", stage="total")
+    record_synthesis("elevenlabs_ws", characters, audio_bytes)
+
+
+async def iterate_fragments(text, delay=0.0):
+    # a finished text replayed as word fragments, e.g. to try stream-input from the UI without an LLM
+    for sentence in split_sentences(text):
+        for word in sentence.split(" "):
+            yield f"{word} "
+            if delay:
+                await asyncio.sleep(delay)
@@ -0,0 +1,276 @@
+import argparse
+import importlib
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import requests
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.datastructures import Headers
+
+from audio_formats import accept_header
+from batch_synthesis import DEFAULT_FORMAT, DEFAULT_SETTINGS
+from fair_scheduler import PRIORITIES, BudgetExceeded
+from tts_cache import make_cache_key
+from tts_metrics import metrics
+
+# headless HTTP API over the same provider functions as the Gradio apps, for backend services :
+#   POST /v1/synthesize            {"text": "...", "provider": "elevenlabs" | "gtts" | "pyttsx3", "voice_id": "...",
+#                                   "model_id": "...", "voice_settings": {...}, "output_format": "mp3_44100_128",
+#                                   "stream": false, "use_cache": true, "priority": "interactive"}
+#                                  -> the audio bytes, or a chunked response as the upstream sends it with "stream": true
+#   GET  /v1/voices?accent=&gender=&age=&use_case=   GET /v1/voices/{voice_id}   GET /v1/models
+#   GET  /health                   GET /metrics (this worker's counters)
+# the caller is billed by the scheduler as the X-TTS-User header, or its address.
+# usage : python tts_api.py --port 8000 --workers 4
+
+MAX_BODY_BYTES = int(os.getenv("api_max_body_bytes", 64 * 1024))
+MAX_TEXT_CHARS = int(os.getenv("api_max_text_chars", 10000))
+MAX_CONCURRENT = int(os.getenv("api_max_concurrent", 64)) # per worker process, 0 = unlimited
+PROVIDERS = ("elevenlabs", "gtts", "pyttsx3")
+
+providers = {}
+providers_lock = threading.Lock()
+active_requests = 0
+
+
+def provider_module(name):
+    # the Gradio apps are imported on first use only : a worker that only serves ElevenLabs never starts pyttsx3
+    module_name = "11labs_example" if name == "elevenlabs" else "gtts_example"
+    if module_name not in providers:
+        with providers_lock:
+            if module_name not in providers:
+                providers[module_name] = importlib.import_module(module_name)
+    return providers[module_name]
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # the catalog is loaded before the first request, off the event loop
+    elevenlabs = await run_in_threadpool(provider_module, "elevenlabs")
+    await run_in_threadpool(elevenlabs.load_catalog)
+    yield
+    # uvicorn stopped accepting connections and let the requests in flight finish first (--graceful-timeout)
+    elevenlabs.client.close()
+    if "gtts_example" in providers:
+        providers["gtts_example"].pyttsx3_pool.shutdown(wait=False)
+
+
+app = FastAPI(title="TTS API", docs_url=None, redoc_url=None, lifespan=lifespan)
+
+
+def error(status_code, detail, headers=None):
+    return JSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+
+
+def request_user(request):
+    return request.headers.get("x-tts-user") or (request.client.host if request.client else "anonymous")
+
+
+class LimitRequests:
+    # sheds load once MAX_CONCURRENT requests are being served instead of queueing them without bound,
+    # and rejects oversized bodies before they are read. A plain ASGI middleware : the slot is held (and the
+    # request timed) until the last body chunk is sent, "stream": true syntheses included, not just the headers
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global active_requests
+        if scope["type"] != "http" or scope["path"] in ("/health", "/metrics"):
+            return await self.app(scope, receive, send)
+        try:
+            content_length = int(Headers(scope=scope).get("content-length") or 0)
+        except ValueError:
+            return await error(400, "Invalid Content-Length")(scope, receive, send)
+        if content_length > MAX_BODY_BYTES:
+            return await error(413, f"Request body over {MAX_BODY_BYTES} bytes")(scope, receive, send)
+        if MAX_CONCURRENT and active_requests >= MAX_CONCURRENT:
+            metrics.inc("api_rejected_total", reason="concurrency")
+            return await error(503, "Too many requests in progress", headers={"Retry-After": "1"})(scope, receive, send)
+        status = "500" # unless the app gets to send its response
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+        active_requests += 1 # single threaded event loop, no lock needed
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            active_requests -= 1
+            route = scope.get("route") # the route template, not the raw path : one series per endpoint
+            metrics.observe("api_request_seconds", time.perf_counter() - start, path=route.path if route else "unmatched", status=status)
+
+
+app.add_middleware(LimitRequests)
+
+
+@app.get("/health")
+async def health():
+    status = {"status": "ok", "pid": os.getpid(), "active_requests": active_requests}
+    if "11labs_example" in providers:
+        elevenlabs = providers["11labs_example"]
+        status["catalog_loaded"] = elevenlabs.catalog_loaded
+        status["scheduler"] = elevenlabs.scheduler.stats()
+    return status
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/v1/models")
+async def list_models():
+    return provider_module("elevenlabs").load_catalog().models
+
+
+@app.get("/v1/voices")
+async def list_voices(accent: str = None, gender: str = None, age: str = None, use_case: str = None):
+    catalog = provider_module("elevenlabs").load_catalog()
+    if not any((accent, gender, age, use_case)):
+        return catalog.voices
+    return catalog.find_voices(accent=accent, gender=gender, age=age, use_case=use_case)
+
+
+@app.get("/v1/voices/{voice_id}")
+async def get_voice(voice_id: str):
+    voice = provider_module("elevenlabs").load_catalog().get_voice(voice_id)
+    if voice is None:
+        return error(404, f"Unknown voice {voice_id}")
+    return voice
+
+
+@app.post("/v1/synthesize")
+async def synthesize(request: Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return error(400, "Body must be a JSON object")
+    if not isinstance(body, dict):
+        return error(400, "Body must be a JSON object")
+    text = body.get("text")
+    provider = body.get("provider", "elevenlabs")
+    priority = body.get("priority", "interactive")
+    if not isinstance(text, str) or not text.strip():
+        return error(400, "text is required")
+    if len(text) > MAX_TEXT_CHARS:
+        return error(413, f"text over {MAX_TEXT_CHARS} characters")
+    if not isinstance(provider, str) or provider not in PROVIDERS:
+        return error(400, f"provider must be one of {', '.join(PROVIDERS)}")
+    if not isinstance(priority, str) or priority not in PRIORITIES:
+        return error(400, f"priority must be one of {', '.join(PRIORITIES)}")
+    for field in ("voice_id", "model_id", "output_format"):
+        if body.get(field) is not None and not isinstance(body[field], str):
+            return error(400, f"{field} must be a string")
+    if body.get("voice_settings") is not None and not isinstance(body["voice_settings"], dict):
+        return error(400, "voice_settings must be an object")
+    for field in ("use_cache", "stream"):
+        if field in body and not isinstance(body[field], bool): # "no" would otherwise count as true
+            return error(400, f"{field} must be a boolean")
+    latency = body.get("optimize_streaming_latency", 0)
+    if isinstance(latency, bool) or not isinstance(latency, int) or not 0 <= latency <= 4:
+        return error(400, "optimize_streaming_latency must be an integer from 0 to 4")
+    if provider == "elevenlabs":
+        return await synthesize_elevenlabs(body, text, request_user(request), priority)
+    return await synthesize_local(body, text, provider)
+
+
+async def synthesize_elevenlabs(body, text, user, priority):
+    elevenlabs = provider_module("elevenlabs")
+    if not body.get("voice_id") or not body.get("model_id"):
+        return error(400, "voice_id and model_id are required")
+    output_format = body.get("output_format", DEFAULT_FORMAT)
+    arguments = {
+        "text": text,
+        "model_id": body["model_id"],
+        "voice_id": body["voice_id"],
+        "voice_settings": body.get("voice_settings") or DEFAULT_SETTINGS,
+        "optimize_streaming_latency": body.get("optimize_streaming_latency", 0),
+        "output_format": output_format,
+        "use_cache": body.get("use_cache", True),
+        "user": user,
+        "priority": priority,
+    }
+    if body.get("stream"):
+        return await stream_elevenlabs(elevenlabs, arguments)
+    try:
+        audio_data, from_cache = await run_in_threadpool(elevenlabs.synthesize_audio, **arguments)
+    except BudgetExceeded as e:
+        return error(429, str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except requests.exceptions.HTTPError as e:
+        metrics.inc("tts_errors_total", provider="elevenlabs")
+        return error(502, f"Upstream error : {e}")
+    except requests.exceptions.RequestException as e:
+        metrics.inc("tts_errors_total", provider="elevenlabs")
+        return error(504, f"Upstream unreachable : {e}")
+    return Response(bytes(audio_data), media_type=accept_header(output_format), headers={"X-Cache": "hit" if from_cache else "miss"})
+
+
+async def stream_elevenlabs(elevenlabs, arguments):
+    # the text_to_speech_stream generator runs in the thread pool : cache hits, single flight and the
+    # scheduler apply as for the Gradio stream. It reports failures as a (None, status) item instead of
+    # raising, so the first item is awaited before the response starts to still answer with an error status
+    items = iterate_in_threadpool(elevenlabs.text_to_speech_stream(**arguments))
+    try:
+        first_chunk, status = await items.__anext__()
+    except StopAsyncIteration:
+        first_chunk, status = None, "Empty stream"
+    if first_chunk is None:
+        if status.startswith("Budget exceeded"):
+            return error(429, status)
+        return error(502, status)
+
+    async def body():
+        yield first_chunk
+        async for chunk, _ in items:
+            if chunk is not None:
+                yield chunk
+
+    return StreamingResponse(body(), media_type=accept_header(arguments["output_format"]))
+
+
+async def synthesize_local(body, text, provider):
+    # gTTS / pyttsx3 through the sentence cache, mp3 / wav. No chunked variant, the audio is joined once complete
+    local = await run_in_threadpool(provider_module, provider)
+    name = "gTTS" if provider == "gtts" else "pyttsx3"
+    voice = body.get("voice_id") or ("en" if provider == "gtts" else None)
+    use_cache = body.get("use_cache", True)
+    try:
+        audio_data, hit_ratio = await run_in_threadpool(
+            local.in_flight.do,
+            make_cache_key(provider=name, voice=voice, text=text, use_cache=use_cache),
+            local.cached_tts, text, name, voice, use_cache=use_cache,
+            )
+    except Exception as e:
+        metrics.inc("tts_errors_total", provider=provider)
+        return error(502, f"{name} error : {e}")
+    return Response(audio_data, media_type="audio/mpeg" if provider == "gtts" else "audio/wav", headers={"X-Cache-Hit-Ratio": f"{hit_ratio:.2f}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP synthesis API, without the Gradio UI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, each with its own clients and memory caches")
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT, help="requests served at once per worker, 503 beyond")
+    parser.add_argument("--graceful-timeout", type=float, default=30, help="seconds the requests in flight get to finish on shutdown")
+    args = parser.parse_args()
+    os.environ["api_max_concurrent"] = str(args.max_concurrent) # read by the worker processes when they import this module
+    uvicorn.run(
+        "tts_api:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level="warning",
+        )
+
+
+if __name__ == "__main__":
+    main()
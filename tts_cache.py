@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from file_utils import write_atomic
+
+
+def normalize_text(text):
+    # collapse whitespace so that trailing spaces / newlines don't create new entries
+    return " ".join((text or "").split())
+
+
+def make_cache_key(**request):
+    # content-addressed key : sha256 of the normalized request, sorted keys, compact separators
+    normalized = {}
+    for key, value in request.items():
+        if key == "text":
+            value = normalize_text(value)
+        elif isinstance(value, dict):
+            # 0 and 0.0 are the same setting : numbers are compared as rounded floats (bools left alone)
+            value = {k: (round(float(v), 4) if isinstance(v, (int, float)) and not isinstance(v, bool) else v) for k, v in value.items() if v is not None}
+        elif isinstance(value, float):
+            value = round(value, 4)
+        normalized[key] = value
+    payload = json.dumps(normalized, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SynthesisCache:
+    # two tiers : an in-memory LRU (bounded by entries and bytes) in front of an on-disk store
+    # bounded by total bytes and entry age. Both tiers are keyed by make_cache_key().
+    # With a SharedStore the disk tier is the store's namespace, shared by every process on the host
+    # (one budget, one LRU order) instead of a directory private to this one.
+    def __init__(
+        self,
+        cache_dir,
+        max_memory_items=128,
+        max_memory_bytes=64 * 1024 * 1024,
+        max_disk_bytes=512 * 1024 * 1024,
+        max_age_seconds=7 * 24 * 3600,
+        store=None,
+        namespace="audio",
+        scan_interval=3600,
+        ):
+        self.cache_dir = cache_dir
+        self.store = store
+        self.namespace = namespace
+        self.max_memory_items = max_memory_items
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age_seconds = max_age_seconds
+        # the directory is scanned once, then puts keep a running byte total and only a total over
+        # max_disk_bytes (or scan_interval elapsed, for the expired entries and the files other
+        # processes wrote) triggers a new scan
+        self.scan_interval = scan_interval
+        self._disk_bytes = None
+        self._next_scan = 0.0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _remember(self, key, data):
+        # caller holds the lock
+        if len(data) > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while len(self._memory) > self.max_memory_items or self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return data
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, data)
+        return data
+
+    def contains(self, key):
+        # presence check for the pre-warm job : doesn't count as a hit or miss and doesn't refresh the entry
+        with self._lock:
+            if key in self._memory:
+                return True
+        if self.store is not None:
+            return self.store.has_blob(self.namespace, key, self.max_age_seconds)
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return False
+        return not (self.max_age_seconds and time.time() - stat.st_mtime > self.max_age_seconds)
+
+    def _read_disk(self, key):
+        if self.store is not None:
+            try:
+                return self.store.get_blob(self.namespace, key, self.max_age_seconds)
+            except sqlite3.Error as e:
+                print(f"Warning : couldn't read cache entry {key} from the shared store : {e}")
+                return None
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if self.max_age_seconds and time.time() - stat.st_mtime > self.max_age_seconds:
+            self._remove(path, stat.st_size)
+            return None
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            os.utime(path) # refresh the entry so that disk eviction is least-recently-used
+            return data
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        if not data:
+            return
+        # a bytearray (the pcm read_body buffer, a stream's accumulated chunks) is copied once : the callers
+        # of get() need bytes (Gradio, Starlette) and the caller may still hold the buffer. bytes aren't copied
+        data = bytes(data)
+        with self._lock:
+            self._remember(key, data)
+        try:
+            if self.store is not None:
+                self.store.put_blob(self.namespace, key, data)
+                self.evict() # two index lookups while the store is under budget
+                return
+            path = self._path(key)
+            try:
+                previous = os.stat(path).st_size
+            except FileNotFoundError:
+                previous = 0
+            write_atomic(path, data, fsync=False)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning : couldn't write cache entry {key} : {e}")
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data) - previous
+            scan = self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes or time.monotonic() >= self._next_scan
+        if scan:
+            self.evict()
+
+    def evict(self):
+        # drop expired entries, then the least recently used ones until the disk tier fits max_disk_bytes
+        if self.store is not None:
+            try:
+                evicted = self.store.evict(self.namespace, self.max_disk_bytes, self.max_age_seconds)
+            except sqlite3.Error as e:
+                print(f"Warning : couldn't evict from the shared store : {e}")
+                return
+            with self._lock:
+                self.evictions += evicted
+            return
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return
+        now = time.time()
+        entries = []
+        total = 0
+        for name in names:
+            if not name.endswith(".bin"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if self.max_age_seconds and now - stat.st_mtime > self.max_age_seconds:
+                self._remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        # once over budget, down to 90 % of it : the next puts don't each pay a scan to free one entry
+        target = self.max_disk_bytes if total <= self.max_disk_bytes else self.max_disk_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+            self._next_scan = time.monotonic() + self.scan_interval
+
+    def _remove(self, path, size=0):
+        try:
+            os.remove(path)
+            with self._lock:
+                self.evictions += 1
+                if self._disk_bytes is not None:
+                    self._disk_bytes -= size
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._disk_bytes = None # rescanned on the next put
+        if self.store is not None:
+            self.store.clear_blobs(self.namespace)
+            return
+        try:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".bin"):
+                    self._remove(os.path.join(self.cache_dir, name))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
@@ -0,0 +1,222 @@
+import cProfile
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def percentile(values, q):
+    # linear interpolation between the closest ranks, q in [0, 100]
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * q / 100
+    lower = int(index)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (index - lower)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in pairs) + "}"
+
+
+class Metrics:
+    # process wide counters and stage timers; an observation is a perf_counter pair plus a dict update
+    # under a lock, cheap enough to leave on in the hot path. Timers keep count / sum and the last
+    # `window` samples for the quantiles.
+    def __init__(self, window=1024):
+        self.window = window
+        self._counters = {}
+        self._timers = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = [0, 0.0, deque(maxlen=self.window)]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2].append(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, function, name, **labels):
+        # wraps a callable, e.g. a Gradio component's postprocess, so that each call is observed
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.timer(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def add_collector(self, prefix, collect):
+        # collect() -> flat dict of numbers read at scrape time (cache stats, client resilience metrics...)
+        self._collectors.append((prefix, collect))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            timers = {key: (count, total, list(samples)) for key, (count, total, samples) in self._timers.items()}
+        gauges = {}
+        for prefix, collect in self._collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Warning : metrics collector {prefix} failed : {e}")
+                continue
+            for name, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[(f"{prefix}_{name}", ())] = value
+        return counters, timers, gauges
+
+    def render_prometheus(self):
+        # Prometheus text exposition format : counters, summaries (p50 / p90 / p99 of the window) and gauges
+        counters, timers, gauges = self.snapshot()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in timers}):
+            lines.append(f"# TYPE {name} summary")
+            for (timer_name, labels), (count, total, samples) in sorted(timers.items()):
+                if timer_name != name:
+                    continue
+                for q in (50, 90, 99):
+                    lines.append(f"{name}{_format_labels(labels, quantile=q / 100)} {percentile(samples, q):.6f}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for (name, labels), value in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        # short human readable version for the diagnostics panels
+        counters, timers, gauges = self.snapshot()
+        lines = []
+        for (name, labels), (count, total, samples) in sorted(timers.items()):
+            label_text = " ".join(str(value) for _, value in labels)
+            lines.append(f"{label_text:32} n={count:<6} p50={percentile(samples, 50) * 1000:8.1f} ms  p95={percentile(samples, 95) * 1000:8.1f} ms  total={total:.2f}s")
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(f"{name}{_format_labels(labels)} = {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            lines.append(f"{name} = {value:.4g}" if isinstance(value, float) else f"{name} = {value}")
+        return "\n".join(lines) or "No requests yet."
+
+
+metrics = Metrics()
+
+
+def stage_timer(provider, stage):
+    return metrics.timer("tts_stage_seconds", provider=provider, stage=stage)
+
+
+def record_synthesis(provider, chars, audio_bytes, cache_hit=None):
+    metrics.inc("tts_requests_total", provider=provider)
+    metrics.inc("tts_chars_total", chars, provider=provider)
+    metrics.inc("tts_bytes_total", audio_bytes, provider=provider)
+    if cache_hit is not None:
+        metrics.inc("tts_cache_hits_total" if cache_hit else "tts_cache_misses_total", provider=provider)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = metrics
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port, host="0.0.0.0", registry=metrics):
+    # serves GET /metrics from a daemon thread, returns the server (server.shutdown() to stop it)
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Metrics served on http://{host}:{server.server_port}/metrics")
+    return server
+
+
+# per request profiling, off unless tts_profiler is "cprofile" or "pyinstrument"; one file per request in tts_profile_dir
+PROFILER = os.getenv("tts_profiler", "").lower()
+PROFILE_DIR = os.getenv("tts_profile_dir", "profiles")
+
+
+@contextmanager
+def _profile(name, profiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}")
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("Warning : pyinstrument isn't installed, profiling with cProfile")
+        else:
+            session = Profiler()
+            session.start()
+            try:
+                yield
+            finally:
+                session.stop()
+                with open(f"{path}.html", "w") as file:
+                    file.write(session.output_html())
+            return
+    session = cProfile.Profile()
+    try:
+        session.enable()
+    except ValueError: # only one cProfile can run at a time : concurrent requests go unprofiled
+        yield
+        return
+    try:
+        yield
+    finally:
+        session.disable()
+        session.dump_stats(f"{path}.prof") # python -m pstats / snakeviz
+
+
+def profile_request(name, profiler=None):
+    profiler = PROFILER if profiler is None else profiler
+    if not profiler:
+        return nullcontext()
+    return _profile(name, profiler)
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tts_metrics import percentile
+
+
+class Provider:
+    # one TTS backend behind a common call : synthesize(text, voice, **options) -> audio bytes,
+    # options are the request's own (e.g. use_cache), passed through as they are
+    def __init__(self, name, synthesize, quality=0, local=False, default_voice=None):
+        self.name = name
+        self._synthesize = synthesize
+        self.quality = quality
+        self.local = local
+        self.default_voice = default_voice
+
+    def synthesize(self, text, voice=None, **options):
+        return self._synthesize(text, voice if voice is not None else self.default_voice, **options)
+
+
+class ProviderStats:
+    # rolling window of the last calls : latency percentiles and error rate
+    def __init__(self, window=100):
+        self.calls = deque(maxlen=window)
+        self.last_call = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.calls.append((latency, ok))
+            self.last_call = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            calls = list(self.calls)
+        latencies = [latency for latency, ok in calls if ok]
+        errors = sum(1 for _, ok in calls if not ok)
+        return {
+            "samples": len(calls),
+            "error_rate": errors / len(calls) if calls else 0.0,
+            "p50": percentile(latencies, 50) if latencies else None,
+            "p95": percentile(latencies, 95) if latencies else None,
+        }
+
+
+class TTSRouter:
+    # routes each request to the best provider for the policy ("latency" or "quality"), skips providers
+    # that are failing or slower than slow_threshold, optionally hedges with the next provider once the
+    # primary passed its p95, and always ends on the local fallback
+    def __init__(
+        self,
+        providers,
+        fallback=None,
+        policy="latency",
+        hedge=False,
+        hedge_min_samples=20,
+        default_hedge_delay=2.0,
+        max_error_rate=0.5,
+        slow_threshold=10.0,
+        probe_interval=30.0,
+        max_workers=16,
+        ):
+        self.providers = {provider.name: provider for provider in providers}
+        self.fallback = fallback
+        self.policy = policy
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.default_hedge_delay = default_hedge_delay
+        self.max_error_rate = max_error_rate
+        self.slow_threshold = slow_threshold
+        self.probe_interval = probe_interval
+        self.stats = {name: ProviderStats() for name in self.providers}
+        if fallback is not None:
+            self.stats.setdefault(fallback.name, ProviderStats())
+        self.hedges = 0
+        self.fallbacks = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-router")
+
+    def _healthy(self, name):
+        stats = self.stats[name].snapshot()
+        if stats["samples"] < 5:
+            return True # not enough data, give it a chance
+        if time.monotonic() - self.stats[name].last_call > self.probe_interval:
+            return True # unused for a while : probe it again so that a recovered provider gets traffic back
+        if stats["error_rate"] > self.max_error_rate:
+            return False
+        return stats["p50"] is None or stats["p50"] <= self.slow_threshold
+
+    def ranked(self, voices):
+        # providers able to serve this request, best first
+        candidates = [
+            provider for name, provider in self.providers.items()
+            if provider is not self.fallback and (name in voices or provider.default_voice is not None)
+            ]
+        def latency(provider):
+            p50 = self.stats[provider.name].snapshot()["p50"]
+            return p50 if p50 is not None else 0.0
+        if self.policy == "quality":
+            candidates.sort(key=lambda provider: (-provider.quality, latency(provider)))
+        else:
+            candidates.sort(key=lambda provider: (latency(provider), -provider.quality))
+        healthy = [provider for provider in candidates if self._healthy(provider.name)]
+        if healthy or self.fallback is not None:
+            return healthy # every network provider slow or failing : straight to the local fallback
+        return candidates
+
+    def _call(self, provider, text, voice, options):
+        start = time.perf_counter()
+        try:
+            audio_data = provider.synthesize(text, voice, **options)
+        except Exception:
+            self.stats[provider.name].record(time.perf_counter() - start, False)
+            raise
+        self.stats[provider.name].record(time.perf_counter() - start, True)
+        return audio_data
+
+    def _hedge_delay(self, provider):
+        stats = self.stats[provider.name].snapshot()
+        if stats["samples"] >= self.hedge_min_samples and stats["p95"] is not None:
+            return stats["p95"]
+        return self.default_hedge_delay
+
+    def synthesize(self, text, voices=None, **options):
+        # voices : provider name -> voice for that provider; returns (audio bytes, provider name)
+        voices = voices or {}
+        queue = self.ranked(voices)
+        if self.fallback is not None:
+            queue.append(self.fallback) # last resort, and the hedge target when it is the only one left
+        errors = []
+        pending = {}
+        while queue or pending:
+            if not pending:
+                provider = queue.pop(0)
+                pending[self._executor.submit(self._call, provider, text, voices.get(provider.name), options)] = provider
+            timeout = None
+            if self.hedge and queue and len(pending) == 1:
+                timeout = self._hedge_delay(next(iter(pending.values())))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # the primary is past its p95 : fire a duplicate on the next provider, first answer wins
+                provider = queue.pop(0)
+                pending[self._executor.submit(self._call, provider, text, voices.get(provider.name), options)] = provider
+                self.hedges += 1
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    audio_data = future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {e}")
+                    continue
+                for other in pending:
+                    other.cancel()
+                if provider is self.fallback:
+                    self.fallbacks += 1
+                return audio_data, provider.name
+        raise RuntimeError(f"Every TTS provider failed : {'; '.join(errors)}")
+
+    def status(self):
+        return {
+            "hedges": self.hedges,
+            "fallbacks": self.fallbacks,
+            "providers": {name: stats.snapshot() for name, stats in self.stats.items()},
+        }
+
+
+def gtts_provider(google_tts, default_voice="en"):
+    return Provider("gtts", google_tts, quality=2, default_voice=default_voice)
+
+
+def pyttsx3_provider(pyttsx3_tts):
+    return Provider("pyttsx3", pyttsx3_tts, quality=1, local=True)
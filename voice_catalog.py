@@ -0,0 +1,228 @@
+import os
+import pickle
+
+from file_utils import write_atomic
+
+SNAPSHOT_VERSION = 1
+
+LABEL_FIELDS = ("accent", "gender", "age", "use_case")
+
+
+def _facet_value(value):
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    return value or None
+
+
+def _source_stamps(sources):
+    stamps = {}
+    for source in sources:
+        try:
+            stat = os.stat(source)
+            stamps[source] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamps[source] = None
+    return stamps
+
+
+class VoiceLabels:
+    __slots__ = ("accent", "description", "age", "gender", "use_case")
+
+    def __init__(self, voice_labels : dict) -> None:
+        if not isinstance(voice_labels, dict):
+            raise ValueError("voice_labels must be a dictionary")
+        self.accent = voice_labels.get("accent", None)
+        self.description = voice_labels.get("description", None)
+        self.age = voice_labels.get("age", None)
+        self.gender = voice_labels.get("gender", None)
+        self.use_case = voice_labels.get("use case", voice_labels.get("usecase", None))
+
+
+class Voice:
+    __slots__ = (
+        "voice", "voice_id", "id", "name", "preview_url", "labels",
+        "fine_tuning", "fine_tuning_state", "fine_tuning_language", "high_quality_base_model_ids",
+        )
+
+    def __init__(self, voice : dict) -> None:
+        self.voice = voice
+        self.voice_id = voice["voice_id"]
+        self.id = self.voice_id
+        self.name = voice.get("name", None)
+        self.preview_url = voice.get("preview_url", None)
+        self.labels = VoiceLabels(voice.get("labels", None) or {})
+        self.fine_tuning : dict | None = voice.get("fine_tuning", None)
+        self.fine_tuning_state = self.fine_tuning.get("finetuning_state", None) if self.fine_tuning else None
+        self.fine_tuning_language = self.fine_tuning.get("language", None) if self.fine_tuning else None
+        self.high_quality_base_model_ids : list = voice.get("high_quality_base_model_ids", None) or []
+
+    @property
+    def accent(self):
+        return self.labels.accent
+
+    @property
+    def description(self):
+        return self.labels.description
+
+    @property
+    def age(self):
+        return self.labels.age
+
+    @property
+    def gender(self):
+        return self.labels.gender
+
+    @property
+    def use_case(self):
+        return self.labels.use_case
+
+
+class _CatalogIndex:
+    # immutable once built : a rebuild creates a new one and swaps it in a single assignment
+    __slots__ = ("voices", "models", "voice_records", "voice_positions", "label_index", "language_index", "voice_choices", "model_choices")
+
+    def __init__(self, voices, models):
+        self.voices = {}
+        self.voice_positions = {}
+        self.voice_records = {}
+        self.label_index = {field: {} for field in LABEL_FIELDS}
+        self.voice_choices = []
+        for voice in voices:
+            voice_id = voice.get("voice_id")
+            if not voice_id:
+                continue
+            record = Voice(voice)
+            self.voices[voice_id] = voice
+            self.voice_positions.setdefault(voice_id, len(self.voice_positions))
+            self.voice_records[voice_id] = record
+            self.voice_choices.append((voice.get("name"), voice_id))
+            for field in LABEL_FIELDS:
+                value = _facet_value(getattr(record.labels, field))
+                if value is not None:
+                    self.label_index[field].setdefault(value, set()).add(voice_id)
+
+        self.models = {}
+        self.language_index = {}
+        self.model_choices = []
+        for model in models:
+            model_id = model.get("model_id")
+            if not model_id:
+                continue
+            self.models[model_id] = model
+            self.model_choices.append((model.get("name"), model_id))
+            for language in model.get("languages") or []:
+                language_id = _facet_value(language.get("language_id"))
+                if language_id is not None:
+                    self.language_index.setdefault(language_id, []).append(model_id)
+
+
+class Catalog:
+    # id -> record dicts and inverted indexes over the voice labels / model languages,
+    # rebuilt only when the voices or models are (re)loaded
+    def __init__(self, voices=None, models=None):
+        self._voices = list(voices or [])
+        self._models = list(models or [])
+        self._index = _CatalogIndex(self._voices, self._models)
+
+    def rebuild(self, voices=None, models=None):
+        if voices is not None:
+            self._voices = list(voices)
+        if models is not None:
+            self._models = list(models)
+        self._index = _CatalogIndex(self._voices, self._models)
+
+    def save_snapshot(self, path, sources):
+        # pickled index + source lists, stamped with the (mtime, size) of the JSON files it was built from
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "sources": _source_stamps(sources),
+            "voices": self._voices,
+            "models": self._models,
+            "index": self._index,
+            }
+        write_atomic(path, pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL), fsync=False)
+
+    def load_snapshot(self, path, sources) -> bool:
+        # swaps in a precompiled index, skipping the JSON parse and the rebuild; False when the snapshot
+        # is missing, unreadable or older than one of its source files
+        try:
+            with open(path, "rb") as file:
+                snapshot = pickle.load(file)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Warning : catalog snapshot {path} couldn't be read : {e}")
+            return False
+        if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("sources") != _source_stamps(sources):
+            return False
+        self._voices = snapshot["voices"]
+        self._models = snapshot["models"]
+        self._index = snapshot["index"]
+        return True
+
+    @property
+    def voices(self):
+        return self._voices
+
+    @property
+    def models(self):
+        return self._models
+
+    def get_voice(self, voice_id) -> dict | None:
+        return self._index.voices.get(voice_id)
+
+    def get_voice_record(self, voice_id) -> Voice | None:
+        return self._index.voice_records.get(voice_id)
+
+    def get_model(self, model_id) -> dict | None:
+        return self._index.models.get(model_id)
+
+    def voice_choices(self):
+        return list(self._index.voice_choices)
+
+    def model_choices(self):
+        return list(self._index.model_choices)
+
+    def label_values(self, field):
+        return sorted(self._index.label_index[field].keys())
+
+    def find_voices(self, accent=None, gender=None, age=None, use_case=None) -> list:
+        # intersection of the matching posting sets, smallest first; no filter returns every voice
+        index = self._index
+        wanted = {"accent": accent, "gender": gender, "age": age, "use_case": use_case}
+        postings = []
+        for field, value in wanted.items():
+            value = _facet_value(value)
+            if value is None:
+                continue
+            posting = index.label_index[field].get(value)
+            if not posting:
+                return []
+            postings.append(posting)
+        if not postings:
+            return list(index.voices.values())
+        postings.sort(key=len)
+        matches = set(postings[0]).intersection(*postings[1:])
+        return [index.voices[voice_id] for voice_id in sorted(matches, key=index.voice_positions.__getitem__)]
+
+    def models_for_language(self, language_id) -> list:
+        index = self._index
+        return [index.models[model_id] for model_id in index.language_index.get(_facet_value(language_id), [])]
+
+
+if __name__ == "__main__":
+    # precompile the snapshot at build time : python voice_catalog.py 11labs/voices.json 11labs/models.json 11labs/catalog.snapshot
+    import json
+    import sys
+    voices_path, models_path, snapshot_path = sys.argv[1:4]
+    with open(voices_path, "r") as file:
+        voices = json.load(file)["voices"]
+    with open(models_path, "r") as file:
+        models = json.load(file)
+    # built through the imported module, not __main__ : the pickle must name classes the app can import
+    import voice_catalog
+    voice_catalog.Catalog(voices, models).save_snapshot(snapshot_path, [voices_path, models_path])
+    if not voice_catalog.Catalog().load_snapshot(snapshot_path, [voices_path, models_path]):
+        sys.exit(f"Catalog snapshot {snapshot_path} doesn't load back")
+    print(f"Catalog snapshot written to {snapshot_path} ({len(voices)} voices, {len(models)} models)")
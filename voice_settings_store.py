@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from file_utils import write_atomic
+
+
+class VoiceSettingsStore:
+    # parsed voice settings keyed by voice_id, persisted in one compact JSON file.
+    # The legacy one-file-per-voice directory is read once to migrate what it holds.
+    # With a SharedStore the settings are rows of the store instead : a voice fetched by one process is
+    # found by the others, and nobody rewrites a whole file another process may be writing too.
+    def __init__(self, client, path, legacy_dir=None, max_workers=8, shared_store=None):
+        self.client = client
+        self.shared_store = shared_store
+        self.path = path
+        self.legacy_dir = legacy_dir
+        self.max_workers = max_workers
+        self.settings = {}
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._prefetch_thread = None
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def ensure_loaded(self):
+        # the files are read on first use, not at import
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.load()
+
+    def load(self):
+        settings = {}
+        if self.legacy_dir and os.path.isdir(self.legacy_dir):
+            for filename in os.listdir(self.legacy_dir):
+                voice_id, extension = os.path.splitext(filename)
+                if extension != ".json":
+                    continue
+                try:
+                    with open(os.path.join(self.legacy_dir, filename), "r") as file:
+                        settings[voice_id] = json.load(file)
+                except (OSError, ValueError):
+                    print(f"Warning : couldn't read voice settings {filename}")
+        try:
+            with open(self.path, "r") as file:
+                settings.update(json.load(file))
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print(f"Warning : {self.path} is corrupted, ignoring it")
+        if self.shared_store is not None:
+            settings.update(self.shared_store.documents("voice_settings"))
+        with self._lock:
+            # merged in place : self.settings keeps its identity and wins over the files (fetched since)
+            for voice_id, voice_settings in settings.items():
+                self.settings.setdefault(voice_id, voice_settings)
+            self._loaded = True
+
+    def save(self):
+        if self.shared_store is not None:
+            return # fetch() already wrote its row
+        self.ensure_loaded() # never overwrite the file with a partial view
+        with self._lock:
+            data = json.dumps(self.settings, separators=(",", ":"), sort_keys=True)
+        with self._save_lock:
+            write_atomic(self.path, data)
+
+    def fetch(self, voice_id):
+        response = self.client.get(f"voices/{voice_id}/settings")
+        with self._lock:
+            self.fetches += 1
+        if response.status_code != 200:
+            with self._lock:
+                self.errors += 1
+            print(f"Failed to fetch voice settings for voice ID {voice_id}. Error: {response.text}")
+            return None
+        voice_settings = response.json()
+        with self._lock:
+            self.settings[voice_id] = voice_settings
+        if self.shared_store is not None:
+            self.shared_store.put_document("voice_settings", voice_id, voice_settings)
+        return voice_settings
+
+    def _from_shared_store(self, voice_id):
+        # another process may have fetched it since this one loaded
+        if self.shared_store is None:
+            return None
+        document = self.shared_store.get_document("voice_settings", voice_id)
+        if document is None:
+            return None
+        with self._lock:
+            self.settings[voice_id] = document[0]
+        return document[0]
+
+    def get(self, voice_id, use_cache=True):
+        self.ensure_loaded()
+        if use_cache:
+            with self._lock:
+                voice_settings = self.settings.get(voice_id)
+                if voice_settings is not None:
+                    self.hits += 1
+                    return voice_settings
+                self.misses += 1
+            voice_settings = self._from_shared_store(voice_id)
+            if voice_settings is not None:
+                return voice_settings
+        voice_settings = self.fetch(voice_id)
+        if voice_settings is not None:
+            self.save()
+        return voice_settings
+
+    def prefetch(self, voice_ids, refresh=False):
+        # fetch every missing voice concurrently, then persist once
+        self.ensure_loaded()
+        if self.shared_store is not None and not refresh:
+            shared = self.shared_store.documents("voice_settings")
+            with self._lock:
+                for voice_id, voice_settings in shared.items():
+                    self.settings.setdefault(voice_id, voice_settings)
+        with self._lock:
+            missing = [voice_id for voice_id in voice_ids if refresh or voice_id not in self.settings]
+        if not missing:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="voice-settings") as executor:
+            results = list(executor.map(self._fetch_quietly, missing))
+        fetched = sum(1 for result in results if result is not None)
+        if fetched:
+            self.save()
+        return fetched
+
+    def _fetch_quietly(self, voice_id):
+        try:
+            return self.fetch(voice_id)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"Failed to fetch voice settings for voice ID {voice_id}. Error: {e}")
+            return None
+
+    def prefetch_in_background(self, voice_ids, refresh=False):
+        if self._prefetch_thread is not None and self._prefetch_thread.is_alive():
+            return self._prefetch_thread
+        self._prefetch_thread = threading.Thread(
+            target=self.prefetch,
+            args=(list(voice_ids), refresh),
+            name="voice-settings-prefetch",
+            daemon=True,
+            )
+        self._prefetch_thread.start()
+        return self._prefetch_thread
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "voices": len(self.settings),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "fetches": self.fetches,
+                "errors": self.errors,
+            }